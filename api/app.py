@@ -8,6 +8,8 @@ from flask import (
     url_for,
     flash,
     send_from_directory,
+    Response,
+    stream_with_context,
 )
 from flask_login import (
     LoginManager,
@@ -18,7 +20,6 @@ from flask_login import (
     current_user,
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 import sys
 import os
 
@@ -39,36 +40,65 @@ from database import (
     User as DBUser,
     create_user,
     update_profile_picture,
+    toggle_reaction,
+    get_reacted_post_ids,
+    follow_user,
+    unfollow_user,
+    is_following,
+    get_home_timeline,
+    attach_comments,
+    add_comment,
+    delete_comment,
+    get_comments,
+    get_post,
+    UserMovingError,
+    ensure_user_writable,
+    FEED_PAGE_SIZE,
 )
 from blob_storage import get_blob_storage, is_blob_storage_available
+from local_storage import LocalStorage
+from live_feed import LIVE_FEED_ENABLED, StreamServer, current_event_id, live_feed_url
+from rate_limit import rate_limited, shed_if_overloaded
+from static_assets import init_assets
+from export import stream_ndjson, stream_zip
 import os
 import datetime
 from dotenv import load_dotenv
 import re  # Add this at the top with other imports
-import random
-import string
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 load_dotenv()
 
-now = datetime.datetime.now()
-timestamp = now.strftime("%Y-%m-%d_%H-%M-%S")
-
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "your-secret-key-here")
 
+# Behind ngrok or another reverse proxy every request comes from the proxy's address; trust that
+# many X-Forwarded-For/-Proto hops so per-IP rate limits see the real client. Leave at 0 when the
+# app is reachable directly, since clients could otherwise spoof the header.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+# Refuse requests early while the server's task queue is backed up
+app.before_request(shed_if_overloaded)
+
 # File storage configuration
 if is_blob_storage_available():
     print("Using Vercel Blob Storage for file uploads")
     STORAGE_TYPE = "blob"
     UPLOAD_FOLDER = ""  # Not needed for blob storage
+    local_storage = None
 else:
     print("Using local file storage (fallback)")
-    app.config["UPLOAD_FOLDER"] = "userUpload"
+    # Absolute, so files are saved where uploaded_file serves them from whatever the working directory
+    app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "userUpload")
     UPLOAD_FOLDER = "userUpload"
+    local_storage = LocalStorage(app.config["UPLOAD_FOLDER"])
     STORAGE_TYPE = "local"
 
 # Initialize database with app
 init_app(app)
+init_assets(app)
 
 # Template helper function
 @app.template_global()
@@ -82,7 +112,8 @@ def get_image_url(image_path):
     if image_path.startswith('http://') or image_path.startswith('https://'):
         return image_path
     
-    # If it's a local file path, add the upload folder prefix
+    # If it's a local file path, add the upload folder prefix. Both sharded paths (ab/cd/<hash>.jpg)
+    # and flat filenames from before sharding map onto uploaded_file
     if STORAGE_TYPE == "local":
         if image_path.startswith('/userUpload/'):
             return image_path
@@ -138,6 +169,23 @@ def load_user(user_id):
     return None
 
 
+def get_page_cursor():
+    """Parse the ?before=<ISO timestamp>_<post ID> paging cursor, ignoring malformed values"""
+    created_at, _, post_id = request.args.get("before", "").rpartition("_")
+    try:
+        return datetime.datetime.fromisoformat(created_at), int(post_id)
+    except ValueError:
+        return None
+
+
+def next_page_cursor(posts):
+    """Cursor for the page after `posts`, or None if this was the last page"""
+    if len(posts) < FEED_PAGE_SIZE:
+        return None
+    last = posts[-1]
+    return f"{last['created_at'].isoformat()}_{last['id']}"
+
+
 def is_valid_username(username):
     """Check if username contains only letters and numbers without spaces"""
     return bool(re.match("^[a-zA-Z0-9]+$", username))
@@ -149,7 +197,17 @@ def index():
     return render_template("index.html")
 
 
+def login_attempt_key():
+    """
+    Login attempts are limited per username *and* client IP: keyed on the username alone,
+    anyone could keep its owner locked out by failing logins for it from elsewhere
+    """
+    username = request.form.get("username")
+    return f"{username}@{request.remote_addr}" if username else None
+
+
 @app.route("/login", methods=["GET", "POST"])
+@rate_limited("login", user_key=login_attempt_key)
 def login():
     if request.method == "POST":
         username = request.form.get("username")
@@ -199,15 +257,24 @@ def profile(username):  # Changed parameter
             user_data.location,
         )
 
-        posts = get_posts(profile_user.id)
+        posts = attach_comments(
+            get_posts(profile_user.id, before=get_page_cursor(), limit=FEED_PAGE_SIZE)
+        )
+        liked_post_ids = get_reacted_post_ids(current_user.id, [post["id"] for post in posts])
         is_owner = current_user.username == profile_user.username  # Changed comparison
+        following = not is_owner and is_following(current_user.id, profile_user.id)
 
         return render_template(
             "profile.html",
             user=profile_user,
             current_user=current_user,
             posts=posts,
+            liked_post_ids=liked_post_ids,
+            next_before=next_page_cursor(posts),
             is_owner=is_owner,
+            following=following,
+            follower_count=user_data.follower_count,
+            following_count=user_data.following_count,
             UPLOAD_FOLDER=UPLOAD_FOLDER,
             # post_id=posts,  # Pass post_id to template
         )
@@ -216,17 +283,102 @@ def profile(username):  # Changed parameter
         return redirect(url_for("index"))
 
 
+@app.route("/follow/<username>", methods=["POST"])
+@login_required
+def follow(username):
+    user_data = get_user_by_username(username)
+    if not user_data:
+        flash("User not found.")
+        return redirect(url_for("feed"))
+    try:
+        follow_user(current_user.id, user_data.id)
+    except Exception as e:
+        flash(f"An error occurred while following @{username}: {str(e)}")
+    return redirect(url_for("profile", username=username))
+
+
+@app.route("/unfollow/<username>", methods=["POST"])
+@login_required
+def unfollow(username):
+    user_data = get_user_by_username(username)
+    if not user_data:
+        flash("User not found.")
+        return redirect(url_for("feed"))
+    try:
+        unfollow_user(current_user.id, user_data.id)
+    except Exception as e:
+        flash(f"An error occurred while unfollowing @{username}: {str(e)}")
+    return redirect(url_for("profile", username=username))
+
+
 @app.route("/delete_post_route/<int:post_id>", methods=["POST"])
 @login_required
 def delete_post_function(post_id):
     try:
-        delete_post(post_id)
-        flash("Post deleted successfully.")
+        if delete_post(post_id, current_user.id):
+            flash("Post deleted successfully.")
+        else:
+            flash("You can only delete your own posts.")
     except Exception as e:
         flash(f"An error occurred while deleting the post: {str(e)}")
     return redirect(url_for("profile", username=current_user.username))
 
 
+# Post URLs carry the author so the post is looked up on the author's shard only
+@app.route("/react/<int:author_id>/<int:post_id>", methods=["POST"])
+@login_required
+def react(author_id, post_id):
+    try:
+        toggle_reaction(post_id, author_id, current_user.id)
+    except UserMovingError as e:
+        flash(str(e))
+    except Exception as e:
+        app.logger.error(f"Error reacting to post: {str(e)}")
+        flash("An error occurred while liking the post.")
+    return redirect(request.referrer or url_for("feed"))
+
+
+@app.route("/post/<int:author_id>/<int:post_id>")
+@login_required
+def view_post(author_id, post_id):
+    post = get_post(post_id, author_id)
+    if not post:
+        flash("Post not found.")
+        return redirect(url_for("feed"))
+    if not post.get("archived"):
+        post["comments"] = get_comments(post_id, author_id)
+    return render_template("post.html", post=post)
+
+
+@app.route("/comment/<int:author_id>/<int:post_id>", methods=["POST"])
+@login_required
+def comment(author_id, post_id):
+    content = request.form.get("content")
+    if not content:
+        flash("Comment cannot be empty")
+    else:
+        try:
+            if not add_comment(post_id, author_id, current_user.id, content):
+                flash("Post not found.")
+        except UserMovingError as e:
+            flash(str(e))
+        except Exception as e:
+            app.logger.error(f"Error adding comment: {str(e)}")
+            flash("An error occurred while adding the comment.")
+    return redirect(request.referrer or url_for("feed"))
+
+
+@app.route("/delete_comment_route/<int:comment_id>", methods=["POST"])
+@login_required
+def delete_comment_function(comment_id):
+    try:
+        if delete_comment(comment_id, current_user.id) is None:
+            flash("You can only delete your own comments or comments on your posts.")
+    except Exception as e:
+        flash(f"An error occurred while deleting the comment: {str(e)}")
+    return redirect(request.referrer or url_for("feed"))
+
+
 @app.route("/delete_profile_picture", methods=["GET", "POST"])
 @login_required
 def delete_profile_picture():
@@ -235,6 +387,7 @@ def delete_profile_picture():
 
 
 @app.route("/register", methods=["GET", "POST"])
+@rate_limited("register", user_key=lambda: request.form.get("username"))
 def register():
     if request.method == "POST":
         username = request.form.get("username")
@@ -252,11 +405,37 @@ def register():
     return render_template("register.html")
 
 
-@app.route("/userUpload/<filename>")
+@app.route("/export")
+@login_required
+def export():
+    """Stream the current user's data; pass ?after=<last post id> to resume an interrupted export"""
+    after = request.args.get("after", 0, type=int)
+    if request.args.get("format") == "zip":
+        chunks = stream_zip(current_user.id, app.config.get("UPLOAD_FOLDER", ""), after)
+        mimetype, extension = "application/zip", "zip"
+    else:
+        chunks = stream_ndjson(current_user.id, after)
+        mimetype, extension = "application/x-ndjson", "ndjson"
+
+    filename = f"facemash-export-{current_user.username}.{extension}"
+    return Response(
+        stream_with_context(chunk for chunk in chunks if chunk),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@app.route("/userUpload/<path:filename>")
 def uploaded_file(filename):
     # For backward compatibility with local storage
     if STORAGE_TYPE == "local":
-        return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+        if "/" in filename:
+            # Sharded files are named after their content, so they never change
+            return send_from_directory(app.config["UPLOAD_FOLDER"], filename, max_age=31536000)
+        # Flat filename from before sharding; the file may since have been migrated
+        return send_from_directory(
+            app.config["UPLOAD_FOLDER"], local_storage.resolve(filename) or filename
+        )
     else:
         # For blob storage, this route shouldn't be used as files are served directly from blob storage
         # But we'll redirect to the blob URL if we can find it
@@ -266,6 +445,7 @@ def uploaded_file(filename):
 
 @app.route("/create_post", methods=["GET", "POST"])
 @login_required
+@rate_limited("create_post", user_key=lambda: current_user.id)
 def create_post():
     if request.method == "POST":
         try:
@@ -276,6 +456,9 @@ def create_post():
                 flash("Post content cannot be empty")
                 return redirect(url_for("create_post"))
 
+            # Checked before the upload so no image is stored for a post that can't be saved
+            ensure_user_writable(current_user.id)
+
             image_path = None
             if image:
                 try:
@@ -290,14 +473,7 @@ def create_post():
                             flash("Blob storage not available, post created without image")
                     else:
                         # Use local storage (fallback)
-                        length = 8
-                        random_string = "".join(
-                            random.choices(string.ascii_letters + string.digits, k=length)
-                        )
-                        filename = secure_filename(
-                            f"post_{current_user.id}_{timestamp}_{random_string}.jpg"
-                        )
-                        image.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+                        filename = local_storage.upload_image(image, current_user.id, "post")
                         image_path = f"/userUpload/{filename}"
                 except Exception as e:
                     app.logger.error(f"Error saving image: {str(e)}")
@@ -309,6 +485,9 @@ def create_post():
                 url_for("profile", username=current_user.username)
             )  # Changed to username
 
+        except UserMovingError as e:
+            flash(str(e))
+            return redirect(url_for("create_post"))
         except Exception as e:
             app.logger.error(f"Error creating post: {str(e)}")
             flash("An error occurred while creating the post. Please try again.")
@@ -319,6 +498,7 @@ def create_post():
 
 @app.route("/edit_profile", methods=["GET", "POST"])
 @login_required
+@rate_limited("edit_profile", user_key=lambda: current_user.id)
 def edit_profile():
     if request.method == "POST":
         changeProfilePicture = request.files.get("profile_picture")
@@ -330,6 +510,8 @@ def edit_profile():
 
         if changeProfilePicture:
             try:
+                # The picture is also posted, so refuse it while the user's posts are being moved
+                ensure_user_writable(current_user.id)
                 if STORAGE_TYPE == "blob":
                     # Use Vercel Blob Storage
                     blob_storage = get_blob_storage()
@@ -359,21 +541,15 @@ def edit_profile():
                         flash("Blob storage not available")
                 else:
                     # Use local storage (fallback)
-                    length = 8
-                    random_string = "".join(
-                        random.choices(string.ascii_letters + string.digits, k=length)
-                    )
-                    filename = secure_filename(f"profile_{current_user.id}_{random_string}.jpg")
-
-                    changeProfilePicture.save(
-                        os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                    )
+                    filename = local_storage.upload_image(changeProfilePicture, current_user.id, "profile")
                     image_path = f"/userUpload/{filename}"
                     
                     update_profile_picture(current_user.id, filename)
                     create_new_post(current_user.id, "Updated profile picture!", image_path)
 
                     flash("Profile picture updated!")
+            except UserMovingError as e:
+                flash(str(e))
             except Exception as e:
                 app.logger.error(f"Error updating profile picture: {str(e)}")
                 flash("Error updating profile picture")
@@ -403,6 +579,7 @@ def edit_profile():
 
 @app.route("/feed", methods=["GET", "POST"])  # Add POST method
 @login_required
+@rate_limited("create_post", user_key=lambda: current_user.id)  # Only POSTs are limited
 def feed():
     try:
         if request.method == "POST":
@@ -413,6 +590,13 @@ def feed():
                 flash("Post content cannot be empty")
                 return redirect(url_for("feed"))
 
+            try:
+                # Checked before the upload so no image is stored for a post that can't be saved
+                ensure_user_writable(current_user.id)
+            except UserMovingError as e:
+                flash(str(e))
+                return redirect(url_for("feed"))
+
             image_path = None
             if image:
                 try:
@@ -427,27 +611,40 @@ def feed():
                             flash("Blob storage not available, post created without image")
                     else:
                         # Use local storage (fallback)
-                        length = 8
-                        random_string = "".join(
-                            random.choices(string.ascii_letters + string.digits, k=length)
-                        )
-                        filename = secure_filename(
-                            f"post_{current_user.id}_{timestamp}_{random_string}.jpg"
-                        )
-                        image.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+                        filename = local_storage.upload_image(image, current_user.id, "post")
                         image_path = f"/userUpload/{filename}"
                 except Exception as e:
                     app.logger.error(f"Error saving image: {str(e)}")
                     flash("Error uploading image, post created without image")
 
-            create_new_post(current_user.id, content, image_path)
+            try:
+                create_new_post(current_user.id, content, image_path)
+            except UserMovingError as e:
+                flash(str(e))
+                return redirect(url_for("feed"))
             flash("Post created successfully!")
             return redirect(url_for("feed"))
 
-        posts = get_posts()
+        # "home" is the follow-based timeline, "all" is every user's posts
+        view = request.args.get("view", "home")
+        # Only the newest page listens for new posts
+        live_updates = LIVE_FEED_ENABLED and "before" not in request.args
+        # Read before the posts, so a post made while the page loads is announced by the stream
+        live_since = current_event_id() if live_updates else 0
+        if view == "all":
+            posts = get_posts(before=get_page_cursor(), limit=FEED_PAGE_SIZE)
+        else:
+            posts = get_home_timeline(current_user.id, before=get_page_cursor())
+        attach_comments(posts)
+        liked_post_ids = get_reacted_post_ids(current_user.id, [post["id"] for post in posts])
         return render_template(
             "feed.html",
             posts=posts,
+            liked_post_ids=liked_post_ids,
+            view=view,
+            next_before=next_page_cursor(posts),
+            live_updates=live_updates,
+            live_since=live_since,
             UPLOAD_FOLDER=UPLOAD_FOLDER,
             current_user=current_user,
         )
@@ -457,11 +654,24 @@ def feed():
         return render_template(
             "feed.html",
             posts=posts,
+            liked_post_ids=set(),
+            view=request.args.get("view", "home"),
             UPLOAD_FOLDER=UPLOAD_FOLDER,
             current_user=current_user,
         )
 
 
+@app.route("/feed/stream")
+@login_required
+def feed_stream():
+    # The stream is served by the asyncio server in live_feed.py so idle connections do not
+    # hold Waitress threads; 204 tells EventSource not to reconnect
+    if not LIVE_FEED_ENABLED:
+        return "", 204
+    query = request.query_string.decode()
+    return redirect(live_feed_url(request) + (f"?{query}" if query else ""), code=307)
+
+
 # add port
 
 if __name__ == "__main__":
@@ -469,11 +679,13 @@ if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
 
     if env == "development":
-        # Development settings
+        # Development settings; the reloader runs the app in a child process, start the stream there
+        if LIVE_FEED_ENABLED and os.getenv("WERKZEUG_RUN_MAIN") == "true":
+            StreamServer(app).start_thread()
         app.run(host="0.0.0.0", port=port, debug=True)
     else:
-        # Production settings - use Waitress
-        from waitress import serve
+        # Production settings - use Waitress, forked into WEB_CONCURRENCY workers
+        from serve import serve_forever
 
-        serve(app, host="0.0.0.0", port=port)
+        serve_forever(app, host="0.0.0.0", port=port)
 
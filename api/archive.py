@@ -0,0 +1,165 @@
+# archive.py
+# Scheduled job that moves old posts from the hot `posts` table into compressed cold storage
+#
+# CLI: python api/archive.py [--months N] [--batch-size N]
+
+import argparse
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import select, text
+
+from database import (
+    db,
+    Post,
+    User,
+    UserShard,
+    Comment,
+    Reaction,
+    TimelineEntry,
+    ArchivedPost,
+    reaction_counts,
+    encode_payload,
+    comment_to_dict,
+    shard_ids,
+    shard_engine,
+    execute_on_shard,
+)
+
+ARCHIVE_AFTER_MONTHS = int(os.getenv('ARCHIVE_AFTER_MONTHS', 6))
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def _month_start(year, month):
+    # Normalize month overflow/underflow, e.g. month 0 is December of the previous year
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return datetime(year, month, 1)
+
+
+def archive_cutoff(months, now=None):
+    """Start of the month `months` months before now; posts older than this are archived"""
+    now = now or datetime.now(timezone.utc)
+    return _month_start(now.year, now.month - months)
+
+
+def ensure_partitions(shard, created_ats):
+    """Create the monthly posts_archive partitions (PostgreSQL only) that rows will land in on a shard"""
+    if shard_engine(shard).dialect.name != 'postgresql':
+        return
+    months = {(created_at.year, created_at.month) for created_at in created_ats}
+    for year, month in sorted(months):
+        start = _month_start(year, month)
+        end = _month_start(year, month + 1)
+        execute_on_shard(shard, text(
+            f"CREATE TABLE IF NOT EXISTS posts_archive_y{year}m{month:02d} "
+            f"PARTITION OF posts_archive FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+
+
+def archive_old_posts(months=ARCHIVE_AFTER_MONTHS, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move posts older than `months` months into posts_archive on every shard, in batches
+    of one transaction each, so the hot tables and their indexes only ever hold recent posts
+
+    Returns:
+        Number of posts archived
+    """
+    cutoff = archive_cutoff(months)
+    # Likes buffered in this process land on the hot rows before they move; likes buffered in web
+    # workers are flushed later and go into the archive payload (see _flush_like_counts)
+    reaction_counts.flush()
+    # rebalance.py copies these users' posts right now; they are archived on a later run
+    moving = db.session.execute(select(UserShard.user_id).where(UserShard.moving)).scalars().all()
+
+    moved = 0
+    for shard in shard_ids():
+        moved += _archive_shard(shard, cutoff, batch_size, moving)
+    return moved
+
+
+def _archive_shard(shard, cutoff, batch_size, skip_user_ids):
+    moved = 0
+    while True:
+        query = select(Post).where(Post.created_at < cutoff)
+        if skip_user_ids:
+            query = query.where(Post.user_id.notin_(skip_user_ids))
+        posts = execute_on_shard(shard, query.order_by(Post.id).limit(batch_size)).scalars().all()
+        if not posts:
+            break
+        post_ids = [post.id for post in posts]
+
+        rows = execute_on_shard(
+            shard,
+            select(Comment)
+            .where(Comment.post_id.in_(post_ids))
+            .order_by(Comment.post_id, Comment.created_at, Comment.id),
+        ).scalars().all()
+        authors = {user.id: user for user in User.query.filter(User.id.in_({row.user_id for row in rows}))}
+        comments = defaultdict(list)
+        for comment in rows:
+            if comment.user_id in authors:
+                comments[comment.post_id].append(comment_to_dict(comment, authors[comment.user_id]))
+
+        try:
+            ensure_partitions(shard, [post.created_at for post in posts])
+            execute_on_shard(
+                shard,
+                ArchivedPost.__table__.insert(),
+                [
+                    {
+                        'id': post.id,
+                        'created_at': post.created_at,
+                        'user_id': post.user_id,
+                        'payload': encode_payload({
+                            'content': post.content,
+                            'image': post.image,
+                            'like_count': post.like_count,
+                            'comments': comments[post.id],
+                        }),
+                    }
+                    for post in posts
+                ],
+            )
+            for table in (Reaction.__table__, Comment.__table__):
+                execute_on_shard(shard, table.delete().where(table.c.post_id.in_(post_ids)))
+            execute_on_shard(shard, Post.__table__.delete().where(Post.__table__.c.id.in_(post_ids)))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+
+        # Timelines are in the main database, committed separately once the posts have moved;
+        # entries for archived posts load nothing, so a failure here only leaves dead rows
+        try:
+            TimelineEntry.query.filter(TimelineEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Warning: Failed to remove timeline entries of archived posts: {e}")
+
+        db.session.expunge_all()
+        moved += len(post_ids)
+        print(f"Archived {moved} posts older than {cutoff:%Y-%m-%d} on shard {shard}")
+
+    engine = shard_engine(shard)
+    if engine.dialect.name == 'postgresql' and moved:
+        # Reclaim the dead tuples now rather than waiting for autovacuum to notice
+        tables = ['posts', 'comments', 'reactions'] + (['home_timeline'] if shard == 0 else [])
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for table in tables:
+                conn.execute(text(f'VACUUM (ANALYZE) {table}'))
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old posts into the posts archive')
+    parser.add_argument('--months', type=int, default=ARCHIVE_AFTER_MONTHS, help='Archive posts older than this')
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        archive_old_posts(args.months, args.batch_size)
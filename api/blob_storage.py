@@ -155,6 +155,11 @@ def get_blob_storage():
     else:
         return None
 
+def reset_blob_storage():
+    """Drop the cached client so a forked worker creates its own"""
+    global blob_storage
+    blob_storage = None
+
 def is_blob_storage_available():
     """Check if blob storage is available"""
     return get_blob_storage() is not None 
\ No newline at end of file
@@ -0,0 +1,114 @@
+# counter_buffer.py
+# In-process write buffer that coalesces counter increments and flushes them in batches
+
+import atexit
+import threading
+from typing import Callable, Dict
+
+
+class PartialFlushError(Exception):
+    def __init__(self, remaining: Dict[int, int]):
+        """Raised by a flush_fn that persisted only part of a batch; `remaining` is retried"""
+        super().__init__(f"{len(remaining)} counters were not flushed")
+        self.remaining = remaining
+
+
+class CounterBuffer:
+    def __init__(self, flush_fn: Callable[[Dict[int, int]], None], flush_interval_ms: int = 250):
+        """
+        Coalesce per-key counter deltas in memory and hand them to flush_fn in batches
+
+        Args:
+            flush_fn: Callable receiving a {key: delta} dict; must persist all of it or raise,
+                raising PartialFlushError if some of it was persisted
+            flush_interval_ms: How often the background thread flushes. 0 disables
+                buffering and every increment is flushed immediately.
+        """
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._pending: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        # Serializes flushes so a shutdown flush never races the background one
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def increment(self, key: int, delta: int = 1):
+        """Add delta to the pending count for key"""
+        with self._lock:
+            total = self._pending.get(key, 0) + delta
+            if total:
+                self._pending[key] = total
+            else:
+                self._pending.pop(key, None)
+
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def pending(self, key: int) -> int:
+        """Delta for key that has not been written yet, so readers can add it to the stored count"""
+        with self._lock:
+            return self._pending.get(key, 0)
+
+    def flush(self) -> int:
+        """
+        Write all pending deltas through flush_fn
+
+        Returns:
+            Number of keys flushed
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                # Put the deltas back so they are retried on the next flush instead of lost
+                retry = e.remaining if isinstance(e, PartialFlushError) else batch
+                with self._lock:
+                    for key, delta in retry.items():
+                        self._pending[key] = self._pending.get(key, 0) + delta
+                raise
+            return len(batch)
+
+    def start(self):
+        """Start the background flush thread and flush on interpreter shutdown"""
+        if self.flush_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="counter-buffer-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background thread and write out whatever is still pending"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing counters on shutdown: {e}")
+
+    def reset_after_fork(self):
+        """
+        Give a forked child fresh locks and its own flush thread; deltas copied from the
+        parent are dropped because the parent flushes them itself
+        """
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing counters: {e}")
@@ -4,14 +4,29 @@ from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 import os
+import heapq
+import json
+import zlib
 from datetime import datetime, timezone
-from sqlalchemy import text
+from sqlalchemy import text, bindparam, select, func, false, inspect, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from counter_buffer import CounterBuffer, PartialFlushError
+from job_queue import JobQueue
+from live_feed import publish
 
 load_dotenv()
 
 db = SQLAlchemy()
 
+# Vercel/Lambda freeze the process between invocations and recycle it without running atexit,
+# so nothing may be left in an in-memory buffer or background thread there
+IS_SERVERLESS = os.getenv('VERCEL') == '1' or os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
+
 # Database Models
+# User, UserShard, IdSequence, Follow and TimelineEntry live in the main database. Post,
+# ArchivedPost, Reaction and Comment live on the shard of the post's author, so they carry
+# no foreign keys to the main database and are written with explicit shard routing.
 class User(db.Model):
     __tablename__ = 'user'
     
@@ -23,35 +38,458 @@ class User(db.Model):
     profile_picture = db.Column(db.String(255), default='placeholder.jpg')
     bio = db.Column(db.Text, default='')
     location = db.Column(db.String(255), default='')
-    
-    # Relationship with posts
-    posts = db.relationship('Post', backref='user', lazy=True, cascade='all, delete-orphan')
+    # Maintained by follow_user/unfollow_user; decides push vs pull fan-out
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     def __repr__(self):
         return f'<User {self.username}>'
 
 
+class UserShard(db.Model):
+    # Shard directory: which database holds a user's posts, archive, comments and reactions.
+    # Users without a row predate sharding and live on shard 0.
+    __tablename__ = 'user_shards'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    shard = db.Column(db.Integer, nullable=False, default=0)
+    # Set by rebalance.py while it copies the user's data; writes for the user are refused meanwhile
+    moving = db.Column(db.Boolean, nullable=False, default=False, server_default=false())
+    
+    def __repr__(self):
+        return f'<UserShard user={self.user_id} shard={self.shard}>'
+
+
+class IdSequence(db.Model):
+    # Post and comment IDs are handed out here so they stay unique across shards
+    __tablename__ = 'id_sequences'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False)
+
+
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (db.Index('ix_posts_user_created', 'user_id', 'created_at'),)
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
     content = db.Column(db.Text, nullable=False)
     image = db.Column(db.String(255))
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    # Maintained by reaction_counts so readers never have to count reaction rows
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Maintained by add_comment/delete_comment in the same transaction as the comment row
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     def __repr__(self):
         return f'<Post {self.id}>'
 
 
+class ArchivedPost(db.Model):
+    # Cold storage for posts moved out of `posts` by archive.py. On PostgreSQL the table is
+    # partitioned by month (archive.py creates the partitions); elsewhere it is a plain table.
+    __tablename__ = 'posts_archive'
+    __table_args__ = (
+        db.Index('ix_posts_archive_user_created', 'user_id', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+    
+    # The partition key has to be part of the primary key
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    # zlib-compressed JSON with the content, image, counts and comments of the post
+    payload = db.Column(db.LargeBinary, nullable=False)
+    
+    def __repr__(self):
+        return f'<ArchivedPost {self.id}>'
+
+
+class Reaction(db.Model):
+    __tablename__ = 'reactions'
+    __table_args__ = (db.UniqueConstraint('post_id', 'user_id', name='uq_reaction_post_user'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False, default='like')
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<Reaction {self.kind} post={self.post_id} user={self.user_id}>'
+
+
+class Comment(db.Model):
+    __tablename__ = 'comments'
+    __table_args__ = (db.Index('ix_comments_post_created', 'post_id', 'created_at'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<Comment {self.id} post={self.post_id}>'
+
+
+class Follow(db.Model):
+    __tablename__ = 'follows'
+    __table_args__ = (db.Index('ix_follows_followed', 'followed_id', 'follower_id'),)
+    
+    follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<Follow {self.follower_id} -> {self.followed_id}>'
+
+
+class TimelineEntry(db.Model):
+    __tablename__ = 'home_timeline'
+    # Home timeline reads are a single range scan over (user_id, created_at)
+    __table_args__ = (db.Index('ix_home_timeline_user_created', 'user_id', 'created_at'),)
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # Posts can be on any shard, so there is no foreign key to posts
+    post_id = db.Column(db.Integer, primary_key=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<TimelineEntry user={self.user_id} post={self.post_id}>'
+
+
+# Authors with at least this many followers are not fanned out on write;
+# their posts are merged into followers' timelines at read time instead
+FANOUT_FOLLOWER_THRESHOLD = int(os.getenv('FANOUT_FOLLOWER_THRESHOLD', 1000))
+# How many of a user's recent posts are copied into a new follower's timeline
+TIMELINE_BACKFILL_SIZE = 50
+FEED_PAGE_SIZE = 50
+# Comments shown under each post in the feed and on profiles
+COMMENTS_PREVIEW_SIZE = 3
+
+# Tables that exist on every shard; everything else lives in the main database
+SHARDED_MODELS = (Post, ArchivedPost, Reaction, Comment)
+# Number of shard databases, set by init_app; shard 0 is the main database
+SHARD_COUNT = 1
+
+
+class UserMovingError(Exception):
+    """The user's data is being moved to another shard; the write can be retried shortly"""
+
+
+def shard_ids():
+    return range(SHARD_COUNT)
+
+
+def shard_engine(shard):
+    """Engine for a shard: the main database for shard 0, otherwise the shard<N> bind"""
+    return db.engines[None] if shard == 0 else db.engines[f'shard{shard}']
+
+
+def execute_on_shard(shard, statement, params=None):
+    """Run a statement in db.session's transaction, but against the given shard's database"""
+    return db.session.execute(statement, params, bind_arguments={'bind': shard_engine(shard)})
+
+
+def hash_shard(user_id):
+    """Shard a user is placed on at registration, and moved to by rebalance.py --all"""
+    return zlib.crc32(str(user_id).encode()) % SHARD_COUNT
+
+
+def get_user_shards(user_ids):
+    """Map user IDs to their shards with one directory query"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    rows = db.session.query(UserShard.user_id, UserShard.shard).filter(UserShard.user_id.in_(user_ids))
+    shards = {user_id: shard for user_id, shard in rows}
+    return {user_id: shards.get(user_id, 0) for user_id in user_ids}
+
+
+def get_user_shard(user_id):
+    return get_user_shards([user_id])[user_id]
+
+
+def _writable_shard(user_id):
+    """Shard to write the user's data to; raises UserMovingError while rebalance.py is moving it"""
+    row = db.session.execute(
+        select(UserShard.shard, UserShard.moving).where(UserShard.user_id == user_id)
+    ).first()
+    if row is None:
+        return 0
+    if row.moving:
+        raise UserMovingError("This account is being moved to another database, please try again in a moment")
+    return row.shard
+
+
+def ensure_user_writable(user_id):
+    """Raise UserMovingError up front, e.g. before uploading an image for a post that could not be saved"""
+    _writable_shard(user_id)
+
+
+def _has_post(shard, post_id, author_id, model=Post):
+    """
+    Whether the author's post is on the shard. Callers pass the shard the directory has for the
+    author, so a post is found with one lookup instead of a probe of every shard, and a copy
+    left on the old shard by a move is never matched.
+    """
+    return execute_on_shard(
+        shard, select(model.id).where(model.id == post_id, model.user_id == author_id)
+    ).first() is not None
+
+
+def _load_posts(post_ids):
+    """Load posts by ID from whichever shards hold them, as {post_id: Post}"""
+    posts = {}
+    remaining = set(post_ids)
+    for shard in shard_ids():
+        if not remaining:
+            break
+        for post in execute_on_shard(shard, select(Post).where(Post.id.in_(remaining))).scalars():
+            posts[post.id] = post
+        remaining -= posts.keys()
+    return posts
+
+
+def _get_authors(user_ids):
+    """Load users from the main database in one query, as {user_id: User}"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    return {user.id: user for user in User.query.filter(User.id.in_(user_ids))}
+
+
+def _posts_to_dicts(posts):
+    authors = _get_authors(post.user_id for post in posts)
+    # Posts whose author no longer exists are dropped, as the old inner join did
+    return [_post_to_dict(post, authors[post.user_id]) for post in posts if post.user_id in authors]
+
+
+def _merge_newest_first(rows_per_shard, limit=None):
+    """k-way merge of per-shard results that are each ordered newest first"""
+    merged = []
+    seen = set()
+    for row in heapq.merge(*rows_per_shard, key=lambda row: (row.created_at, row.id), reverse=True):
+        # A user being moved briefly has a copy on both shards
+        if row.id in seen:
+            continue
+        seen.add(row.id)
+        merged.append(row)
+        if limit and len(merged) == limit:
+            break
+    return merged
+
+
+def _older_than(created_at, row_id, before):
+    """
+    Keyset condition for rows after the (created_at, id) cursor `before` in newest-first
+    order. The ID breaks ties, so posts sharing a timestamp at a page boundary are not skipped.
+    """
+    return tuple_(created_at, row_id) < tuple_(*before)
+
+
+def _allocate_id(name, models):
+    """
+    Hand out the next ID for `name` from id_sequences. The first allocation starts above the
+    highest ID of `models` on every shard, so rows created before sharding keep theirs.
+    Call it before writing anything in the session: on SQLite a pending write would lock it out.
+    """
+    table = IdSequence.__table__
+    while True:
+        with db.engine.begin() as conn:
+            allocated = conn.execute(
+                table.update()
+                .where(table.c.name == name)
+                .values(last_id=table.c.last_id + 1)
+                .returning(table.c.last_id)
+            ).scalar()
+        if allocated is not None:
+            return allocated
+
+        start = 0
+        for shard in shard_ids():
+            with shard_engine(shard).connect() as conn:
+                for model in models:
+                    start = max(start, conn.execute(select(func.max(model.id))).scalar() or 0)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values(name=name, last_id=start))
+        except IntegrityError:
+            # Another process created the sequence first; allocate from it
+            pass
+
+
+def _insert_timeline_entries():
+    """
+    INSERT into home_timeline that skips entries already there: a follow's backfill and the
+    fan-out of the followed user's new post may both add the same (user, post)
+    """
+    timeline = TimelineEntry.__table__
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+
+        return insert(timeline).on_conflict_do_nothing()
+    return timeline.insert().prefix_with('OR IGNORE')
+
+
+def _fan_out_post(post_id, author_id):
+    """Copy a new post into the author's and, for regular accounts, every follower's home timeline"""
+    # Reading the post first means a post deleted before the job runs simply fans out to nobody
+    with shard_engine(get_user_shard(author_id)).connect() as conn:
+        created_at = conn.execute(select(Post.created_at).where(Post.id == post_id)).scalar()
+    if created_at is None:
+        return
+
+    follower_entries = (
+        select(Follow.follower_id, db.literal(post_id), db.literal(created_at, db.DateTime))
+        .join(User, User.id == Follow.followed_id)
+        .where(
+            Follow.followed_id == author_id,
+            User.follower_count < FANOUT_FOLLOWER_THRESHOLD,
+        )
+    )
+    with db.engine.begin() as conn:
+        conn.execute(_insert_timeline_entries().values(user_id=author_id, post_id=post_id, created_at=created_at))
+        conn.execute(_insert_timeline_entries().from_select(['user_id', 'post_id', 'created_at'], follower_entries))
+
+
+# Fan-out-on-write runs off the request path, except on serverless hosts where a queued job
+# could be frozen or dropped with the instance
+timeline_fanout = JobQueue(
+    _fan_out_post,
+    run_async=os.getenv('FANOUT_ASYNC', '0' if IS_SERVERLESS else '1') != '0',
+    name='timeline-fanout',
+)
+
+
+def _flush_like_counts(deltas):
+    """
+    Apply coalesced like deltas to posts.like_count in one batched UPDATE per shard. Deltas for
+    posts that archive.py moved since the like go into the like_count of the archive payload.
+    """
+    stmt = (
+        Post.__table__.update()
+        .where(Post.__table__.c.id == bindparam('b_post_id'))
+        .values(like_count=Post.__table__.c.like_count + bindparam('b_delta'))
+    )
+    unapplied = dict(deltas)
+    error = None
+    # Every shard holding a post gets the delta, so a post that is mid-move is counted on both copies
+    for shard in shard_ids():
+        try:
+            with shard_engine(shard).begin() as conn:
+                post_ids = conn.execute(select(Post.id).where(Post.id.in_(list(deltas)))).scalars().all()
+                if post_ids:
+                    conn.execute(stmt, [{'b_post_id': post_id, 'b_delta': deltas[post_id]} for post_id in post_ids])
+                missing = [post_id for post_id in unapplied if post_id not in post_ids]
+                archived_ids = _add_archived_likes(conn, missing, deltas)
+        except Exception as e:
+            error = e
+            continue
+        for post_id in post_ids + archived_ids:
+            unapplied.pop(post_id, None)
+    if error is not None:
+        # Retry only what no shard took, so shards that committed are not counted twice
+        raise PartialFlushError(unapplied) from error
+    if unapplied:
+        print(f"Warning: Dropped like counts of {len(unapplied)} deleted posts: {sorted(unapplied)}")
+
+
+def _add_archived_likes(conn, post_ids, deltas):
+    """Add like deltas to archived posts on the shard of `conn`; returns the IDs that were archived"""
+    if not post_ids:
+        return []
+    archived = conn.execute(
+        select(ArchivedPost.id, ArchivedPost.created_at, ArchivedPost.payload)
+        .where(ArchivedPost.id.in_(post_ids))
+        # The payload is rewritten whole, so concurrent flushes must not both read the old count
+        .with_for_update()
+    ).all()
+    table = ArchivedPost.__table__
+    for post_id, created_at, payload in archived:
+        data = decode_payload(payload)
+        data['like_count'] = (data.get('like_count') or 0) + deltas[post_id]
+        conn.execute(
+            table.update()
+            .where(table.c.id == post_id, table.c.created_at == created_at)
+            .values(payload=encode_payload(data))
+        )
+    return [post_id for post_id, _, _ in archived]
+
+
+# Coalesces like/unlike clicks so a hot post gets one UPDATE per flush instead of one per click
+reaction_counts = CounterBuffer(
+    _flush_like_counts,
+    # Write-through on serverless hosts, where a buffered like would be lost with the instance
+    flush_interval_ms=int(os.getenv('REACTION_FLUSH_INTERVAL_MS', 0 if IS_SERVERLESS else 250)),
+)
+
+
+# Columns added to tables that already existed in earlier versions. db.create_all() only creates
+# missing tables, so upgrade_schema adds these to existing ones; each needs a server_default.
+ADDED_COLUMNS = (
+    ('posts', 'like_count'),
+    ('user', 'follower_count'),
+    ('user', 'following_count'),
+    ('posts', 'comment_count'),
+)
+
+
+def upgrade_schema(engine, tables):
+    """
+    Bring tables created by an earlier version up to date: add the ADDED_COLUMNS they lack and
+    create missing indexes. Safe to run on every start.
+    """
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table in tables:
+            if table.name not in existing:
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if (table.name, column.name) not in ADDED_COLUMNS or column.name in columns:
+                    continue
+                preparer = engine.dialect.identifier_preparer
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+                    f"{column.type.compile(dialect=engine.dialect)} "
+                    f"{'' if column.nullable else 'NOT NULL '}DEFAULT {column.server_default.arg}"
+                ))
+                print(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def _shard_urls(database_url):
+    """
+    URLs of shards 1..N-1: DATABASE_SHARD_URLS if set, otherwise with SHARD_COUNT and a SQLite
+    main database, SQLite files next to it (facebook_clone_shard1.db, ...)
+    """
+    urls = [url.strip() for url in os.getenv('DATABASE_SHARD_URLS', '').split(',') if url.strip()]
+    count = int(os.getenv('SHARD_COUNT', 1))
+    if urls or count <= 1:
+        return urls
+    if database_url.startswith('sqlite:'):
+        base, ext = os.path.splitext(database_url)
+        return [f"{base}_shard{shard}{ext}" for shard in range(1, count)]
+    print("Warning: SHARD_COUNT > 1 needs DATABASE_SHARD_URLS unless the database is SQLite. Using one shard.")
+    return []
+
+
 def init_app(app):
     """Initialize the database with the Flask app."""
     # Configure PostgreSQL database URL with SQLite fallback for development
     database_url = os.getenv('DATABASE_URL')
     
-    if database_url:
+    if database_url and database_url.startswith('sqlite:'):
+        # Explicit SQLite database, e.g. a local file or one per test/benchmark run
+        print(f"Using SQLite database at {database_url}")
+    elif database_url:
         # Detect if we're running in Vercel/serverless environment
-        is_vercel = os.getenv('VERCEL') == '1' or os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
+        is_vercel = IS_SERVERLESS
         
         # Handle postgres:// URLs and choose driver based on environment
         if database_url.startswith('postgres://'):
@@ -96,6 +534,14 @@ def init_app(app):
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
+    # Shard 0 is the main database; the others are binds named shard1, shard2, ...
+    global SHARD_COUNT
+    shard_urls = _shard_urls(database_url)
+    app.config['SQLALCHEMY_BINDS'] = {f'shard{shard}': url for shard, url in enumerate(shard_urls, start=1)}
+    SHARD_COUNT = 1 + len(shard_urls)
+    if shard_urls:
+        print(f"Sharding posts across {SHARD_COUNT} databases")
+    
     db.init_app(app)
     
     with app.app_context():
@@ -103,6 +549,11 @@ def init_app(app):
             # Test the connection first
             db.engine.connect()
             db.create_all()
+            upgrade_schema(db.engine, db.metadata.sorted_tables)
+            for shard in range(1, SHARD_COUNT):
+                sharded_tables = [model.__table__ for model in SHARDED_MODELS]
+                db.metadata.create_all(bind=shard_engine(shard), tables=sharded_tables)
+                upgrade_schema(shard_engine(shard), sharded_tables)
             print("Database tables created successfully!")
         except Exception as e:
             print(f"Database connection error: {e}")
@@ -121,6 +572,31 @@ def init_app(app):
                 print(f"SQLite fallback also failed: {sqlite_error}")
                 raise sqlite_error
 
+    # The flush thread runs outside any request, so it needs its own app context
+    def flush_in_context(deltas):
+        with app.app_context():
+            _flush_like_counts(deltas)
+
+    reaction_counts.flush_fn = flush_in_context
+    reaction_counts.start()
+
+    def fan_out_in_context(post_id, author_id):
+        with app.app_context():
+            _fan_out_post(post_id, author_id)
+
+    timeline_fanout.handler = fan_out_in_context
+    timeline_fanout.start()
+
+
+def reset_after_fork(app):
+    """Drop pooled connections and restart background threads inherited from the parent process"""
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the parent's connections alone and just forgets them here
+            engine.dispose(close=False)
+    reaction_counts.reset_after_fork()
+    timeline_fanout.reset_after_fork()
+
 
 def init_db():
     """Initialize the database tables."""
@@ -128,44 +604,79 @@ def init_db():
 
 
 def create_new_post(user_id, content, image=None):
-    """Create a new post"""
+    """Create a new post on the author's shard"""
+    shard = _writable_shard(user_id)
+    post_id = _allocate_id('posts', (Post, ArchivedPost))
     try:
-        post = Post(
+        execute_on_shard(shard, Post.__table__.insert().values(
+            id=post_id,
             user_id=user_id,
             content=content,
             image=image
-        )
-        db.session.add(post)
+        ))
         db.session.commit()
-        return True
     except Exception as e:
         db.session.rollback()
         raise e
 
+    timeline_fanout.submit(post_id, user_id)
+    publish('post', {'id': post_id, 'user_id': user_id})
+    return True
 
-def delete_post(post_id):
-    """Delete a post by its ID."""
+
+def delete_post(post_id, user_id):
+    """Delete one of the user's posts, whether it is still hot or already archived."""
+    # Users delete their own posts, which are on their own shard
+    shard = _writable_shard(user_id)
+    hot = execute_on_shard(
+        shard, select(Post.image).where(Post.id == post_id, Post.user_id == user_id)
+    ).first()
+    archived = hot is None
+    if archived:
+        payload = execute_on_shard(shard, select(ArchivedPost.payload).where(
+            ArchivedPost.id == post_id, ArchivedPost.user_id == user_id
+        )).scalar()
+        if payload is None:
+            return False
     try:
-        post = Post.query.get(post_id)
-        if post:
+        if not archived:
             # Store image URL for cleanup
-            image_url = post.image
-            
-            db.session.delete(post)
-            db.session.commit()
-            
-            # Cleanup blob storage file if it's a blob URL
-            if image_url and (image_url.startswith('http://') or image_url.startswith('https://')):
-                try:
-                    from blob_storage import get_blob_storage
-                    blob_storage = get_blob_storage()
-                    if blob_storage:
-                        blob_storage.delete_file(image_url)
-                except Exception as cleanup_error:
-                    print(f"Warning: Failed to cleanup blob storage file: {cleanup_error}")
+            image_url = hot.image
             
-            return True
-        return False
+            # Reactions and comments are on the post's shard, where ORM cascades can't reach
+            for table, column in (
+                (Reaction.__table__, Reaction.__table__.c.post_id),
+                (Comment.__table__, Comment.__table__.c.post_id),
+                (Post.__table__, Post.__table__.c.id),
+            ):
+                execute_on_shard(shard, table.delete().where(column == post_id))
+        else:
+            image_url = decode_payload(payload).get('image')
+            execute_on_shard(shard, ArchivedPost.__table__.delete().where(ArchivedPost.__table__.c.id == post_id))
+        db.session.commit()
+        publish('delete', {'id': post_id})
+
+        # The shard and the main database commit separately, so timeline entries are removed only
+        # once the post is gone. Entries left behind by a failure here load nothing and are skipped.
+        if not archived:
+            try:
+                TimelineEntry.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception as cleanup_error:
+                db.session.rollback()
+                print(f"Warning: Failed to remove timeline entries of post {post_id}: {cleanup_error}")
+        
+        # Cleanup blob storage file if it's a blob URL
+        if image_url and (image_url.startswith('http://') or image_url.startswith('https://')):
+            try:
+                from blob_storage import get_blob_storage
+                blob_storage = get_blob_storage()
+                if blob_storage:
+                    blob_storage.delete_file(image_url)
+            except Exception as cleanup_error:
+                print(f"Warning: Failed to cleanup blob storage file: {cleanup_error}")
+        
+        return True
     except Exception as e:
         db.session.rollback()
         raise e
@@ -196,6 +707,8 @@ def create_user(username, password, firstName=None, lastName=None):
             lastName=lastName
         )
         db.session.add(user)
+        db.session.flush()
+        db.session.add(UserShard(user_id=user.id, shard=hash_shard(user.id)))
         db.session.commit()
         return True
     except Exception as e:
@@ -231,32 +744,103 @@ def update_profile(user_id, username, firstName, lastName, bio, location):
         raise e
 
 
-def get_posts(user_id=None):
-    """Get posts for a specific user or all posts"""
+def get_posts(user_id=None, before=None, limit=None):
+    """
+    Get posts for a specific user or all posts, newest first. Without a limit only hot
+    posts are returned; with one, the page of posts after the (created_at, id) cursor
+    `before` is returned and the archive is only read once the hot table has run out of posts.
+    """
+    query = select(Post)
     if user_id:
-        # Get posts for a specific user with user information
-        posts = db.session.query(Post, User).join(User).filter(Post.user_id == user_id).order_by(Post.created_at.desc()).all()
+        # A user's posts are all on one shard
+        shards = [get_user_shard(user_id)]
+        query = query.where(Post.user_id == user_id)
     else:
-        # Get all posts with user information
-        posts = db.session.query(Post, User).join(User).order_by(Post.created_at.desc()).all()
-    
-    # Convert to a format similar to the original SQLite row factory
-    result = []
-    for post, user in posts:
-        post_dict = {
-            'id': post.id,
-            'user_id': post.user_id,
-            'content': post.content,
-            'image': post.image,
-            'created_at': post.created_at,
-            'username': user.username,
-            'profile_picture': user.profile_picture
-        }
-        result.append(post_dict)
+        shards = shard_ids()
+    if before:
+        query = query.where(_older_than(Post.created_at, Post.id, before))
+    query = query.order_by(Post.created_at.desc(), Post.id.desc())
+    if limit:
+        query = query.limit(limit)
     
+    posts = _merge_newest_first(
+        [execute_on_shard(shard, query).scalars().all() for shard in shards], limit
+    )
+    result = _posts_to_dicts(posts)
+    if limit and len(result) < limit:
+        # Posts can straddle the archive cutoff while the job runs, so merge rather than append
+        result = sorted(
+            result + get_archived_posts(user_id, before, limit),
+            key=lambda post: (post['created_at'], post['id']),
+            reverse=True,
+        )[:limit]
     return result
 
 
+def get_archived_posts(user_id=None, before=None, limit=FEED_PAGE_SIZE):
+    """Get archived posts after the cursor `before`, newest first, in the same format as get_posts"""
+    query = select(ArchivedPost)
+    if user_id:
+        shards = [get_user_shard(user_id)]
+        query = query.where(ArchivedPost.user_id == user_id)
+    else:
+        shards = shard_ids()
+    if before:
+        query = query.where(_older_than(ArchivedPost.created_at, ArchivedPost.id, before))
+    query = query.order_by(ArchivedPost.created_at.desc(), ArchivedPost.id.desc()).limit(limit)
+    rows = _merge_newest_first(
+        [execute_on_shard(shard, query).scalars().all() for shard in shards], limit
+    )
+    authors = _get_authors(archived.user_id for archived in rows)
+    return [
+        _archived_post_to_dict(archived, authors[archived.user_id])
+        for archived in rows if archived.user_id in authors
+    ]
+
+
+def encode_payload(data):
+    """Compress an archived post's JSON payload"""
+    return zlib.compress(json.dumps(data, default=str).encode('utf-8'), 9)
+
+
+def decode_payload(payload):
+    """Decompress an archived post's JSON payload"""
+    return json.loads(zlib.decompress(payload))
+
+
+def _archived_post_to_dict(archived, user, comments_limit=COMMENTS_PREVIEW_SIZE):
+    payload = decode_payload(archived.payload)
+    comments = payload.get('comments', [])
+    return {
+        'id': archived.id,
+        'user_id': archived.user_id,
+        'content': payload['content'],
+        'image': payload.get('image'),
+        'created_at': archived.created_at,
+        'username': user.username,
+        'profile_picture': user.profile_picture,
+        'like_count': payload.get('like_count', 0),
+        'comment_count': len(comments),
+        'comments': comments[:comments_limit] if comments_limit else comments,
+        'archived': True
+    }
+
+
+def _post_to_dict(post, user):
+    """Convert a post and its author to a format similar to the original SQLite row factory"""
+    return {
+        'id': post.id,
+        'user_id': post.user_id,
+        'content': post.content,
+        'image': post.image,
+        'created_at': post.created_at,
+        'username': user.username,
+        'profile_picture': user.profile_picture,
+        'like_count': get_like_count(post),
+        'comment_count': post.comment_count or 0
+    }
+
+
 def update_profile_picture(user_id, filename):
     """Update the user's profile picture."""
     try:
@@ -269,3 +853,296 @@ def update_profile_picture(user_id, filename):
     except Exception as e:
         db.session.rollback()
         raise e
+
+
+def get_like_count(post):
+    """Stored like count plus any increments still waiting in the write buffer"""
+    return (post.like_count or 0) + reaction_counts.pending(post.id)
+
+
+def toggle_reaction(post_id, author_id, user_id, kind='like'):
+    """Like a post, or remove the like if the user already reacted. Returns True if the post is now liked."""
+    # Reactions are stored with the post, on its author's shard
+    shard = _writable_shard(author_id)
+    if not _has_post(shard, post_id, author_id):
+        return False
+    reactions = Reaction.__table__
+    try:
+        reaction_id = execute_on_shard(shard, select(reactions.c.id).where(
+            reactions.c.post_id == post_id, reactions.c.user_id == user_id
+        )).scalar()
+        if reaction_id:
+            execute_on_shard(shard, reactions.delete().where(reactions.c.id == reaction_id))
+            db.session.commit()
+            reaction_counts.increment(post_id, -1)
+            return False
+
+        execute_on_shard(shard, reactions.insert().values(post_id=post_id, user_id=user_id, kind=kind))
+        db.session.commit()
+        reaction_counts.increment(post_id, 1)
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def get_reacted_post_ids(user_id, post_ids):
+    """Return the subset of post_ids the user has reacted to, in a single query"""
+    if not post_ids:
+        return set()
+    # Reactions sit with the post, so a page of posts from several authors spans several shards
+    query = select(Reaction.post_id).where(Reaction.user_id == user_id, Reaction.post_id.in_(post_ids))
+    reacted = set()
+    for shard in shard_ids():
+        reacted.update(execute_on_shard(shard, query).scalars())
+    return reacted
+
+
+def follow_user(follower_id, followed_id):
+    """Follow a user and backfill their recent posts into the follower's timeline"""
+    if follower_id == followed_id:
+        return False
+    try:
+        if db.session.get(Follow, (follower_id, followed_id)):
+            return False
+        db.session.add(Follow(follower_id=follower_id, followed_id=followed_id))
+        User.query.filter_by(id=followed_id).update({User.follower_count: User.follower_count + 1})
+        User.query.filter_by(id=follower_id).update({User.following_count: User.following_count + 1})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+    # Posts from high-follower accounts are merged at read time, so only regular accounts need copying
+    followed = db.session.get(User, followed_id)
+    if followed and followed.follower_count < FANOUT_FOLLOWER_THRESHOLD:
+        recent = execute_on_shard(
+            get_user_shard(followed_id),
+            select(Post.id, Post.created_at)
+            .where(Post.user_id == followed_id)
+            .order_by(Post.created_at.desc())
+            .limit(TIMELINE_BACKFILL_SIZE),
+        ).all()
+        try:
+            if recent:
+                db.session.execute(_insert_timeline_entries(), [
+                    {'user_id': follower_id, 'post_id': post_id, 'created_at': created_at}
+                    for post_id, created_at in recent
+                ])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Warning: Failed to backfill timeline: {e}")
+    return True
+
+
+def unfollow_user(follower_id, followed_id):
+    """Unfollow a user and drop their posts from the follower's timeline"""
+    try:
+        follow = db.session.get(Follow, (follower_id, followed_id))
+        if not follow:
+            return False
+        # Timeline entries are in the main database and the posts on the followed user's shard,
+        # so the post IDs are fetched first and deleted in chunks instead of with a subquery
+        followed_posts = execute_on_shard(
+            get_user_shard(followed_id), select(Post.id).where(Post.user_id == followed_id)
+        ).scalars().all()
+        db.session.delete(follow)
+        User.query.filter_by(id=followed_id).update({User.follower_count: User.follower_count - 1})
+        User.query.filter_by(id=follower_id).update({User.following_count: User.following_count - 1})
+        for start in range(0, len(followed_posts), 500):
+            TimelineEntry.query.filter(
+                TimelineEntry.user_id == follower_id,
+                TimelineEntry.post_id.in_(followed_posts[start:start + 500]),
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def is_following(follower_id, followed_id):
+    """Check whether follower_id follows followed_id"""
+    return db.session.get(Follow, (follower_id, followed_id)) is not None
+
+
+def get_home_timeline(user_id, before=None, limit=FEED_PAGE_SIZE):
+    """
+    Get the user's home timeline: the materialized (fan-out-on-write) entries merged
+    with recent posts from followed high-follower accounts (fan-out-on-read).
+    `before` is a (created_at, post id) cursor that pages back to older entries.
+    """
+    query = db.session.query(TimelineEntry.post_id).filter(TimelineEntry.user_id == user_id)
+    if before:
+        query = query.filter(_older_than(TimelineEntry.created_at, TimelineEntry.post_id, before))
+    entry_ids = query.order_by(
+        TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()
+    ).limit(limit).all()
+    # Entries whose post has been deleted have nothing to load and drop out here
+    loaded = _load_posts(post_id for post_id, in entry_ids)
+    pushed = [loaded[post_id] for post_id, in entry_ids if post_id in loaded]
+
+    celebrity_ids = db.session.execute(
+        select(Follow.followed_id).join(User, User.id == Follow.followed_id).where(
+            Follow.follower_id == user_id,
+            User.follower_count >= FANOUT_FOLLOWER_THRESHOLD,
+        )
+    ).scalars().all()
+    pulled_per_shard = []
+    by_shard = {}
+    for celebrity_id, shard in get_user_shards(celebrity_ids).items():
+        by_shard.setdefault(shard, []).append(celebrity_id)
+    for shard, author_ids in by_shard.items():
+        pulled = select(Post).where(Post.user_id.in_(author_ids))
+        if before:
+            pulled = pulled.where(_older_than(Post.created_at, Post.id, before))
+        pulled_per_shard.append(execute_on_shard(
+            shard, pulled.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit)
+        ).scalars().all())
+
+    # An account that crossed the threshold may appear in both lists
+    return _posts_to_dicts(_merge_newest_first([pushed] + pulled_per_shard, limit))
+
+
+def comment_to_dict(comment, user):
+    """Convert a comment and its author to the dict shape used by templates and archive payloads"""
+    return {
+        'id': comment.id,
+        'post_id': comment.post_id,
+        'user_id': comment.user_id,
+        'content': comment.content,
+        'created_at': comment.created_at,
+        'username': user.username,
+        'profile_picture': user.profile_picture
+    }
+
+
+def add_comment(post_id, author_id, user_id, content):
+    """Add a comment to a post and bump the post's comment count"""
+    shard = _writable_shard(author_id)
+    if not _has_post(shard, post_id, author_id):
+        return False
+    comment_id = _allocate_id('comments', (Comment,))
+    posts = Post.__table__
+    try:
+        execute_on_shard(shard, Comment.__table__.insert().values(
+            id=comment_id, post_id=post_id, user_id=user_id, content=content
+        ))
+        execute_on_shard(shard, posts.update().where(posts.c.id == post_id).values(
+            comment_count=posts.c.comment_count + 1
+        ))
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def delete_comment(comment_id, user_id):
+    """Delete a comment if user_id wrote it or owns the post. Returns the post ID, or None."""
+    # The comment is on the same shard as its post; comment IDs are unique across shards
+    query = (
+        select(Comment.post_id, Comment.user_id, Post.user_id.label('post_author_id'))
+        .join(Post, Post.id == Comment.post_id)
+        .where(Comment.id == comment_id)
+    )
+    for shard in shard_ids():
+        row = execute_on_shard(shard, query).first()
+        if row and (SHARD_COUNT == 1 or get_user_shard(row.post_author_id) == shard):
+            break
+    else:
+        return None
+    if user_id not in (row.user_id, row.post_author_id):
+        return None
+    _writable_shard(row.post_author_id)
+    comments = Comment.__table__
+    posts = Post.__table__
+    try:
+        post_id = row.post_id
+        execute_on_shard(shard, comments.delete().where(comments.c.id == comment_id))
+        execute_on_shard(shard, posts.update().where(posts.c.id == post_id).values(
+            comment_count=posts.c.comment_count - 1
+        ))
+        db.session.commit()
+        return post_id
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def get_comments(post_id, author_id):
+    """Get every comment on a post, oldest first"""
+    comments = execute_on_shard(
+        get_user_shard(author_id),
+        select(Comment).where(Comment.post_id == post_id).order_by(Comment.created_at, Comment.id),
+    ).scalars().all()
+    return _comments_to_dicts(comments)
+
+
+def _comments_to_dicts(comments):
+    authors = _get_authors(comment.user_id for comment in comments)
+    return [
+        comment_to_dict(comment, authors[comment.user_id])
+        for comment in comments if comment.user_id in authors
+    ]
+
+
+def attach_comments(posts, limit=COMMENTS_PREVIEW_SIZE):
+    """
+    Set post['comments'] to the first `limit` comments of every post in one windowed
+    query, so a page of posts costs the same number of queries however long it is
+    """
+    # Archived posts carry their comments in the archive payload
+    posts_to_load = [post for post in posts if not post.get('archived')]
+    for post in posts_to_load:
+        post['comments'] = []
+    if not posts_to_load:
+        return posts
+
+    by_id = {post['id']: post for post in posts_to_load}
+    # Comments live with their post, i.e. on the shard of the post's author
+    author_shards = get_user_shards(post['user_id'] for post in posts_to_load)
+    post_ids_by_shard = {}
+    for post in posts_to_load:
+        post_ids_by_shard.setdefault(author_shards[post['user_id']], []).append(post['id'])
+
+    comments = []
+    for shard, post_ids in post_ids_by_shard.items():
+        ranked = (
+            select(
+                Comment,
+                func.row_number().over(
+                    partition_by=Comment.post_id,
+                    order_by=(Comment.created_at, Comment.id),
+                ).label('rn'),
+            )
+            .where(Comment.post_id.in_(post_ids))
+            .subquery()
+        )
+        ranked_comment = aliased(Comment, ranked)
+        comments.extend(execute_on_shard(
+            shard,
+            select(ranked_comment)
+            .where(ranked.c.rn <= limit)
+            .order_by(ranked_comment.post_id, ranked.c.rn),
+        ).scalars())
+    for comment in _comments_to_dicts(comments):
+        by_id[comment['post_id']]['comments'].append(comment)
+    return posts
+
+
+def get_post(post_id, author_id):
+    """Get a single post with its author, in the same format as get_posts"""
+    shard = get_user_shard(author_id)
+    post = execute_on_shard(shard, select(Post).where(Post.id == post_id, Post.user_id == author_id)).scalar()
+    if post is not None:
+        result = _posts_to_dicts([post])
+        return result[0] if result else None
+    archived = execute_on_shard(shard, select(ArchivedPost).where(
+        ArchivedPost.id == post_id, ArchivedPost.user_id == author_id
+    )).scalar()
+    if archived is None:
+        return None
+    author = db.session.get(User, author_id)
+    return _archived_post_to_dict(archived, author, comments_limit=None) if author else None
@@ -0,0 +1,234 @@
+# export.py
+# Streaming per-user data export as NDJSON or as a ZIP that also carries the media
+#
+# CLI: python api/export.py <username> [--zip] [--after POST_ID] [-o FILE]
+
+import argparse
+import contextlib
+import heapq
+import io
+import json
+import os
+import sys
+import urllib.request
+import zipfile
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import select
+
+from database import db, Post, ArchivedPost, User, decode_payload, execute_on_shard, get_user_shard
+from local_storage import LocalStorage
+
+# Rows fetched per round trip; with psycopg2 this becomes a server-side cursor
+EXPORT_BATCH_SIZE = 500
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _ndjson(record: dict) -> bytes:
+    return (json.dumps(record, default=_json_default) + '\n').encode('utf-8')
+
+
+def _media_name(post_id: int, image: str) -> str:
+    return f"media/{post_id}_{os.path.basename(image.split('?', 1)[0])}"
+
+
+def _profile_media_name(picture: str) -> str:
+    return f"media/profile_{os.path.basename(picture.split('?', 1)[0])}"
+
+
+def _has_profile_picture(picture) -> bool:
+    return bool(picture) and picture != 'placeholder.jpg'
+
+
+def _iter_posts(user_id: int, after: int, with_images_only: bool = False) -> Iterator[dict]:
+    """
+    Stream the user's hot and archived posts in id order without loading them all into
+    memory; the two server-side cursors on the user's shard are merged as they are read
+    """
+    shard = get_user_shard(user_id)
+    stmt = (
+        select(Post.id, Post.content, Post.image, Post.created_at, Post.like_count, Post.comment_count)
+        .where(Post.user_id == user_id, Post.id > after)
+        .order_by(Post.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if with_images_only:
+        stmt = stmt.where(Post.image.isnot(None))
+    hot = (dict(row._mapping) for row in execute_on_shard(shard, stmt))
+
+    archived_stmt = (
+        select(ArchivedPost.id, ArchivedPost.created_at, ArchivedPost.payload)
+        .where(ArchivedPost.user_id == user_id, ArchivedPost.id > after)
+        .order_by(ArchivedPost.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    archived = (_archived_row(row) for row in execute_on_shard(shard, archived_stmt))
+    if with_images_only:
+        archived = (row for row in archived if row['image'])
+
+    yield from heapq.merge(hot, archived, key=lambda row: row['id'])
+
+
+def _archived_row(row) -> dict:
+    payload = decode_payload(row.payload)
+    return {
+        'id': row.id,
+        'content': payload['content'],
+        'image': payload.get('image'),
+        'created_at': row.created_at,
+        'like_count': payload.get('like_count', 0),
+        'comment_count': len(payload.get('comments', [])),
+    }
+
+
+def iter_records(user_id: int, after: int = 0, include_media: bool = False) -> Iterator[dict]:
+    """
+    Yield the export as records: the profile (only on a fresh export), every post after
+    `after`, and a final "end" record. A client that stops before the end record can
+    resume by passing the id of the last post it received as `after`.
+    """
+    if after == 0:
+        user = db.session.get(User, user_id)
+        profile = {
+            'type': 'profile',
+            'id': user.id,
+            'username': user.username,
+            'firstName': user.firstName,
+            'lastName': user.lastName,
+            'bio': user.bio,
+            'location': user.location,
+            'profile_picture': user.profile_picture,
+        }
+        if include_media and _has_profile_picture(user.profile_picture):
+            profile['media'] = _profile_media_name(user.profile_picture)
+        yield profile
+
+    last_id = after
+    for row in _iter_posts(user_id, after):
+        record = {'type': 'post', **row}
+        if include_media and row['image']:
+            record['media'] = _media_name(row['id'], row['image'])
+        last_id = row['id']
+        yield record
+
+    yield {'type': 'end', 'last_id': last_id}
+
+
+def stream_ndjson(user_id: int, after: int = 0) -> Iterator[bytes]:
+    for record in iter_records(user_id, after):
+        yield _ndjson(record)
+
+
+def _open_media(image: str, upload_folder: str):
+    """Open a post image from blob storage or the local upload folder as a binary stream"""
+    if image.startswith('http://') or image.startswith('https://'):
+        return urllib.request.urlopen(image, timeout=30)
+    storage = LocalStorage(upload_folder)
+    relative = storage.resolve(image) or os.path.basename(image)
+    return open(os.path.join(upload_folder, relative), 'rb')
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only sink for ZipFile that hands back whatever has been written since the last drain"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _write_media(archive: zipfile.ZipFile, sink: _ZipStream, name: str, image: str,
+                 upload_folder: str) -> Iterator[bytes]:
+    """Copy one image into the archive in chunks; a missing image is skipped with a warning"""
+    try:
+        source = _open_media(image, upload_folder)
+    except Exception as e:
+        print(f"Warning: Skipping media {name}: {e}")
+        return
+    # Images are already compressed, so store them as-is
+    info = zipfile.ZipInfo(name, datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    with source, archive.open(info, 'w', force_zip64=True) as entry:
+        while chunk := source.read(MEDIA_CHUNK_SIZE):
+            entry.write(chunk)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_zip(user_id: int, upload_folder: str, after: int = 0) -> Iterator[bytes]:
+    """
+    Stream a ZIP holding export.ndjson, and under media/ the profile picture (on a fresh
+    export) and the post images. Entries are written with data descriptors, so nothing is
+    buffered beyond one chunk.
+    """
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        info = zipfile.ZipInfo('export.ndjson', datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, 'w', force_zip64=True) as entry:
+            for record in iter_records(user_id, after, include_media=True):
+                entry.write(_ndjson(record))
+                yield sink.drain()
+
+        if after == 0:
+            picture = db.session.get(User, user_id).profile_picture
+            if _has_profile_picture(picture):
+                yield from _write_media(archive, sink, _profile_media_name(picture), picture, upload_folder)
+
+        for row in _iter_posts(user_id, after, with_images_only=True):
+            yield from _write_media(
+                archive, sink, _media_name(row['id'], row['image']), row['image'], upload_folder
+            )
+
+    yield sink.drain()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a user\'s profile, posts and images')
+    parser.add_argument('username')
+    parser.add_argument('--zip', action='store_true', help='Write a ZIP including media instead of NDJSON')
+    parser.add_argument('--after', type=int, default=0, help='Resume after this post id')
+    parser.add_argument('-o', '--output', help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    out = open(args.output, 'ab' if args.after and not args.zip else 'wb') if args.output else sys.stdout.buffer
+
+    # Keep the app's startup messages out of an export written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import app
+        from database import get_user_by_username
+
+        with app.app_context(), out:
+            user = get_user_by_username(args.username)
+            if not user:
+                sys.exit(f"User {args.username} not found")
+
+            if args.zip:
+                chunks = stream_zip(user.id, app.config.get('UPLOAD_FOLDER', ''), args.after)
+            else:
+                chunks = stream_ndjson(user.id, args.after)
+            for chunk in chunks:
+                if chunk:
+                    out.write(chunk)
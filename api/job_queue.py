@@ -0,0 +1,70 @@
+# job_queue.py
+# Single background worker thread that runs jobs off the request path
+
+import atexit
+import queue
+import threading
+from typing import Callable
+
+
+class JobQueue:
+    def __init__(self, handler: Callable, run_async: bool = True, name: str = "job-queue"):
+        """
+        Run handler(*args) for every submitted job on a background thread
+
+        Args:
+            handler: Callable invoked with the arguments passed to submit()
+            run_async: When False (e.g. serverless, where threads are frozen between
+                requests) jobs run inline inside submit()
+            name: Thread name, useful in logs and stack dumps
+        """
+        self.handler = handler
+        self.run_async = run_async
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def submit(self, *args):
+        """Queue a job, or run it right away if the queue is not running asynchronously"""
+        if not self.run_async or self._thread is None:
+            self.handler(*args)
+            return
+        self._queue.put(args)
+
+    def join(self):
+        """Block until every queued job has been processed"""
+        self._queue.join()
+
+    def start(self):
+        """Start the worker thread and drain the queue on interpreter shutdown"""
+        if not self.run_async or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Finish outstanding jobs and stop the worker thread"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def reset_after_fork(self):
+        """Give a forked child an empty queue and its own worker thread"""
+        self._queue = queue.Queue()
+        self._thread = None
+        self.start()
+
+    def _run(self):
+        while True:
+            args = self._queue.get()
+            try:
+                if args is None:
+                    return
+                self.handler(*args)
+            except Exception as e:
+                print(f"Error running {self.name} job {args}: {e}")
+            finally:
+                self._queue.task_done()
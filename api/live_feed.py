@@ -0,0 +1,384 @@
+# live_feed.py
+# Live feed updates over Server-Sent Events
+#
+# Posts and deletes are appended to a local SQLite event log that every worker process on the
+# host shares. One asyncio stream server per host polls the log past its high-water mark and
+# fans each event out to its subscribers, so thousands of idle connections cost no threads.
+#
+# Run standalone: python api/live_feed.py
+
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from http.cookies import SimpleCookie
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+# Off unless browsers can reach the stream: LIVE_FEED_URL routes it through a proxy on the main
+# origin, or LIVE_FEED_ENABLED=1 says LIVE_FEED_PORT is open (e.g. local development). The ngrok
+# tunnel and Vercel only expose the app itself, where an unreachable stream would just make every
+# open feed reconnect every few seconds.
+LIVE_FEED_ENABLED = os.getenv('LIVE_FEED_ENABLED', '1' if os.getenv('LIVE_FEED_URL') else '0') != '0'
+LIVE_FEED_PORT = int(os.getenv('LIVE_FEED_PORT', 5001))
+# How often the stream server checks the log for events published by other processes
+LIVE_FEED_POLL_MS = int(os.getenv('LIVE_FEED_POLL_MS', 100))
+
+HEARTBEAT_SECONDS = 15
+# Events a subscriber may fall behind by before it is disconnected; the browser reconnects and
+# catches up from Last-Event-ID
+SUBSCRIBER_QUEUE_SIZE = 100
+# Recent events kept in memory for reconnecting clients
+REPLAY_SIZE = 1000
+# Log rows older than this are deleted
+EVENT_TTL_SECONDS = 3600
+
+
+class EventLog:
+    def __init__(self, path: str):
+        """
+        Append-only event log in a local SQLite file. SQLite serializes writers, so ids are
+        committed in increasing order and readers can safely poll past a high-water mark.
+
+        Args:
+            path: SQLite database file; created on first use
+        """
+        self.path = path
+        self._local = threading.local()
+        self._appends = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS events '
+                '(id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def reset_after_fork(self):
+        """SQLite connections must not be shared with a forked child"""
+        self._local = threading.local()
+
+    def append(self, kind: str, data: dict) -> int:
+        conn = self._connection()
+        now = time.time()
+        event_id = conn.execute(
+            'INSERT INTO events (kind, data, created) VALUES (?, ?, ?)', (kind, json.dumps(data), now)
+        ).lastrowid
+        self._appends += 1
+        if self._appends % 1000 == 0:
+            conn.execute('DELETE FROM events WHERE created < ?', (now - EVENT_TTL_SECONDS,))
+        return event_id
+
+    def since(self, last_id: int, limit: int = 1000) -> list:
+        """Events after last_id as (id, kind, data) tuples, oldest first"""
+        rows = self._connection().execute(
+            'SELECT id, kind, data FROM events WHERE id > ? ORDER BY id LIMIT ?', (last_id, limit)
+        ).fetchall()
+        return [(event_id, kind, json.loads(data)) for event_id, kind, data in rows]
+
+    def high_water(self) -> int:
+        return self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+
+class Subscriber:
+    def __init__(self, user_id: int, following: Optional[set]):
+        """
+        One open stream
+
+        Args:
+            user_id: Viewer
+            following: Authors whose posts the viewer wants, or None for every post
+        """
+        self.user_id = user_id
+        self.following = following
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, kind: str, data: dict) -> bool:
+        if kind != 'post' or self.following is None:
+            return True
+        return data['user_id'] == self.user_id or data['user_id'] in self.following
+
+
+def _message(event_id: int, kind: str, data: dict) -> bytes:
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class Broker:
+    def __init__(self):
+        """In-process pub/sub; every method runs on the stream server's event loop"""
+        self.subscribers = set()
+        self.recent = deque(maxlen=REPLAY_SIZE)
+
+    def subscribe(self, subscriber: Subscriber, last_event_id: int = 0):
+        """
+        Register subscriber, first queueing anything it missed since last_event_id: the
+        Last-Event-ID of a reconnect, or the ?since= a freshly rendered page was current up to
+        """
+        self.subscribers.add(subscriber)
+        if last_event_id:
+            for event_id, kind, data, message in self.recent:
+                if event_id > last_event_id and subscriber.wants(kind, data):
+                    self._deliver(subscriber, message)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def broadcast(self, event_id: int, kind: str, data: dict):
+        # Encoded once, then shared by every queue
+        message = _message(event_id, kind, data)
+        self.recent.append((event_id, kind, data, message))
+        for subscriber in list(self.subscribers):
+            if subscriber.wants(kind, data):
+                self._deliver(subscriber, message)
+
+    def _deliver(self, subscriber: Subscriber, message: bytes):
+        try:
+            subscriber.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too slow to keep up; the browser reconnects and catches up from Last-Event-ID
+            self.close(subscriber)
+
+    def close(self, subscriber: Subscriber):
+        """Drop the subscriber's backlog and tell its handler to end the stream"""
+        self.unsubscribe(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+
+event_log = EventLog(os.getenv('LIVE_FEED_DB', os.path.join(tempfile.gettempdir(), 'facemash_live_feed.db')))
+# Set while a stream server runs in this process, so local publishes skip the poll interval
+_local_server = None
+
+
+def publish(kind: str, data: dict):
+    """
+    Record a feed event for the stream servers. Never raises: a broken event log must not
+    fail the post or delete that triggered it.
+    """
+    if not LIVE_FEED_ENABLED:
+        return
+    try:
+        event_log.append(kind, data)
+    except Exception as e:
+        print(f"Warning: Failed to publish live feed event: {e}")
+        return
+    server = _local_server
+    if server is not None:
+        server.wake()
+
+
+def current_event_id() -> int:
+    """
+    Newest event in the log, read before rendering a page so its stream resumes from there
+    and replays what was published while it loaded. Never raises.
+    """
+    try:
+        return event_log.high_water()
+    except Exception as e:
+        print(f"Warning: Failed to read live feed event log: {e}")
+        return 0
+
+
+class StreamServer:
+    def __init__(self, app, host: str = '0.0.0.0', port: int = LIVE_FEED_PORT):
+        """
+        Minimal HTTP server for GET /feed/stream, authenticated with the Flask session cookie
+
+        Args:
+            app: Flask app whose secret key signs the session and whose database holds follows
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.broker = Broker()
+        self._loop = None
+        self._wake = None
+
+    def wake(self):
+        """Poll the log now instead of at the next interval; callable from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _session_user(self, cookie_header: str) -> Optional[int]:
+        cookie = SimpleCookie()
+        cookie.load(cookie_header)
+        morsel = cookie.get(self.app.config['SESSION_COOKIE_NAME'])
+        if morsel is None:
+            return None
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        try:
+            session = serializer.loads(
+                morsel.value, max_age=int(self.app.permanent_session_lifetime.total_seconds())
+            )
+        except Exception:
+            return None
+        user_id = session.get('_user_id')
+        return int(user_id) if user_id else None
+
+    def _following(self, user_id: int) -> set:
+        from database import db, Follow
+
+        with self.app.app_context():
+            rows = db.session.query(Follow.followed_id).filter(Follow.follower_id == user_id)
+            return {followed_id for (followed_id,) in rows}
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        # Start with the replay buffer filled, so pages rendered before this server started can
+        # still resume from their ?since=
+        last_id = max(await loop.run_in_executor(None, event_log.high_water) - REPLAY_SIZE, 0)
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), LIVE_FEED_POLL_MS / 1000.0)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                events = await loop.run_in_executor(None, event_log.since, last_id)
+            except Exception as e:
+                print(f"Error reading live feed events: {e}")
+                continue
+            for event_id, kind, data in events:
+                self.broker.broadcast(event_id, kind, data)
+                last_id = event_id
+
+    async def _respond(self, writer, status: str, headers: dict, body: bytes = b''):
+        lines = [f"HTTP/1.1 {status}"] + [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = request_line.split(' ', 2)
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(':')
+                if name:
+                    headers[name.strip().lower()] = value.strip()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            writer.close()
+            return
+
+        cors = {}
+        origin = headers.get('origin')
+        # The page is served from the main port, so the browser sends a cross-origin request;
+        # only the same host may read the stream with its cookies
+        if origin and urlsplit(origin).hostname == urlsplit('//' + headers.get('host', '')).hostname:
+            cors = {'Access-Control-Allow-Origin': origin, 'Access-Control-Allow-Credentials': 'true', 'Vary': 'Origin'}
+
+        subscriber = None
+        try:
+            url = urlsplit(target)
+            if method != 'GET' or url.path != '/feed/stream':
+                await self._respond(writer, '404 Not Found', {'Content-Length': 0, 'Connection': 'close'})
+                return
+            user_id = self._session_user(headers.get('cookie', ''))
+            if user_id is None:
+                await self._respond(writer, '401 Unauthorized', {**cors, 'Content-Length': 0, 'Connection': 'close'})
+                return
+
+            view = parse_qs(url.query).get('view', ['home'])[0]
+            following = None
+            if view != 'all':
+                following = await asyncio.get_running_loop().run_in_executor(None, self._following, user_id)
+            # A reconnect's Last-Event-ID is newer than the ?since= baked into the stream URL
+            try:
+                last_event_id = int(headers.get('last-event-id') or parse_qs(url.query).get('since', [0])[0])
+            except ValueError:
+                last_event_id = 0
+
+            await self._respond(writer, '200 OK', {
+                **cors,
+                'Content-Type': 'text/event-stream',
+                'Cache-Control': 'no-cache',
+                'Connection': 'keep-alive',
+                # Stop nginx from buffering the stream
+                'X-Accel-Buffering': 'no',
+            }, b'retry: 3000\n\n')
+
+            subscriber = Subscriber(user_id, following)
+            self.broker.subscribe(subscriber, last_event_id)
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    message = b': keepalive\n\n'
+                if message is None:
+                    break
+                writer.write(message)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            print(f"Error serving live feed stream: {e}")
+        finally:
+            if subscriber is not None:
+                self.broker.unsubscribe(subscriber)
+            writer.close()
+
+    async def serve(self, stop: Optional[asyncio.Event] = None):
+        global _local_server
+
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port, backlog=2048)
+        poller = asyncio.create_task(self._poll())
+        _local_server = self
+        print(f"Live feed streaming on http://{self.host}:{self.port}/feed/stream")
+        try:
+            async with server:
+                try:
+                    if stop is None:
+                        await server.serve_forever()
+                    else:
+                        await stop.wait()
+                finally:
+                    # Closing the server waits for open connections, so end every stream first
+                    for subscriber in list(self.broker.subscribers):
+                        self.broker.close(subscriber)
+        finally:
+            _local_server = None
+            poller.cancel()
+
+    def run(self):
+        """Serve in this thread until SIGTERM or SIGINT"""
+
+        async def main():
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, stop.set)
+            await self.serve(stop)
+
+        asyncio.run(main())
+
+    def start_thread(self):
+        """Serve from a daemon thread next to a threaded WSGI server in the same process"""
+        threading.Thread(target=lambda: asyncio.run(self.serve()), name='live-feed', daemon=True).start()
+
+
+def live_feed_url(request) -> str:
+    """Public URL of the stream; LIVE_FEED_URL overrides it when a proxy routes /feed/stream"""
+    return os.getenv('LIVE_FEED_URL') or (
+        f"{request.scheme}://{urlsplit('//' + request.host).hostname}:{LIVE_FEED_PORT}/feed/stream"
+    )
+
+
+if __name__ == '__main__':
+    from app import app
+
+    StreamServer(app).run()
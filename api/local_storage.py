@@ -0,0 +1,153 @@
+# local_storage.py
+# Local upload storage (fallback when blob storage is not configured), sharded into ab/cd/ subdirectories
+#
+# Migrate a flat upload folder: python api/local_storage.py [--batch-size N] [--pause SECONDS]
+
+import argparse
+import hashlib
+import itertools
+import os
+import tempfile
+import time
+from typing import Optional
+
+# Extensions kept from the uploaded filename; anything else is stored as .jpg like before
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+# Files in the upload folder that ship with the repo and stay where they are
+KEEP_FLAT = ('README.md', 'placeholder.jpg')
+MIGRATE_BATCH_SIZE = 500
+
+
+def shard_path(digest: str, filename: str) -> str:
+    """Two levels of 256 directories each keep every directory small, e.g. ab/cd/<filename>"""
+    return f"{digest[:2]}/{digest[2:4]}/{filename}"
+
+
+def legacy_shard_path(filename: str) -> str:
+    """Where the migration moves a flat file; derived from its name so stored references stay valid"""
+    return shard_path(hashlib.sha256(filename.encode()).hexdigest(), filename)
+
+
+class LocalStorage:
+    def __init__(self, root: str):
+        """
+        Content-addressed image storage under root
+
+        New uploads are stored as ab/cd/<sha256>.<ext> and referenced by that relative path.
+        Files from the old flat layout are referenced by bare filename and resolve either
+        to root/<filename> or, once migrated, to root/<legacy_shard_path(filename)>.
+
+        Args:
+            root: Absolute path of the upload folder
+        """
+        self.root = root
+
+    def upload_image(self, image_file, user_id: int, prefix: str = "image") -> str:
+        """
+        Save an uploaded image, named after the hash of its content
+
+        Args:
+            image_file: Flask file object
+            user_id: Unused; kept so the signature matches VercelBlobStorage.upload_image
+            prefix: Unused, as above
+
+        Returns:
+            Path relative to the upload folder, e.g. 'ab/cd/<sha256>.jpg'
+        """
+        ext = os.path.splitext((image_file.filename or '').lower())[1]
+        if ext == '.jpeg' or ext not in IMAGE_EXTENSIONS:
+            ext = '.jpg'
+
+        # Hash while streaming to a temp file in the same folder so the final rename is atomic
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: image_file.stream.read(64 * 1024), b''):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            relative = shard_path(digest.hexdigest(), digest.hexdigest() + ext)
+            target = os.path.join(self.root, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Identical content maps to the same file, so an existing one is simply reused
+            os.replace(tmp_path, target)
+            return relative
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def resolve(self, path: str) -> Optional[str]:
+        """
+        Map a stored image reference to a path relative to the upload folder
+
+        Args:
+            path: Sharded relative path, or a bare filename from the old flat layout
+
+        Returns:
+            The relative path of the existing file, or None
+        """
+        path = path.split('?', 1)[0]
+        if path.startswith('/userUpload/'):
+            path = path[len('/userUpload/'):]
+        if '/' in path:
+            candidates = [path]
+        else:
+            # Check the flat location first: the migration may move the file between the two checks,
+            # and it only ever moves files from flat to sharded
+            candidates = [path, legacy_shard_path(path)]
+        for candidate in candidates:
+            if os.path.isfile(os.path.join(self.root, candidate)):
+                return candidate
+        return None
+
+    def migrate_flat_files(self, batch_size: int = MIGRATE_BATCH_SIZE, pause: float = 0.0) -> int:
+        """
+        Move files from the top of the upload folder into their shard directories
+
+        Safe to run while the app is serving: each move is a single rename, and resolve() finds
+        a file at either location. Interrupted runs can simply be restarted.
+
+        Returns:
+            Number of files moved
+        """
+        moved = 0
+        while True:
+            # Stop reading the directory once the batch is full; moved files drop out of the
+            # listing, so the next scan picks up where this one left off
+            with os.scandir(self.root) as entries:
+                batch = list(itertools.islice(
+                    (
+                        entry.name for entry in entries
+                        if entry.is_file() and entry.name not in KEEP_FLAT and not entry.name.startswith('.')
+                    ),
+                    batch_size,
+                ))
+            if not batch:
+                break
+
+            for filename in batch:
+                target = os.path.join(self.root, legacy_shard_path(filename))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.rename(os.path.join(self.root, filename), target)
+                except FileNotFoundError:
+                    # Moved by another run
+                    continue
+                moved += 1
+            print(f"Moved {moved} files into shard directories")
+            if pause:
+                time.sleep(pause)
+        return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move flat uploads into ab/cd/ shard directories')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'userUpload'))
+    parser.add_argument('--batch-size', type=int, default=MIGRATE_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+    args = parser.parse_args()
+
+    LocalStorage(args.root).migrate_flat_files(args.batch_size, args.pause)
@@ -0,0 +1,199 @@
+# rate_limit.py
+# Token-bucket rate limiting and admission control for expensive routes
+
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import wraps
+from typing import Callable, Optional
+
+from flask import request
+
+# Limits are (burst, tokens refilled per second), applied per user and per client IP
+LIMITS = {
+    'login': {'user': (5, 5 / 60), 'ip': (20, 1)},
+    'register': {'user': (3, 3 / 3600), 'ip': (5, 1 / 60)},
+    'create_post': {'user': (10, 10 / 60), 'ip': (30, 1)},
+    'edit_profile': {'user': (5, 5 / 60), 'ip': (20, 1)},
+}
+
+# Buckets idle for longer than this are deleted
+BUCKET_TTL_SECONDS = 3600
+
+
+class TokenBucketStore:
+    def __init__(self, path: str):
+        """
+        Token buckets kept in a local SQLite file so every worker process on the host shares them
+
+        Args:
+            path: SQLite database file; created on first use
+        """
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def reset_after_fork(self):
+        """SQLite connections must not be shared with a forked child"""
+        self._local = threading.local()
+
+    def take(self, buckets: dict) -> float:
+        """
+        Take one token from every bucket, or from none of them
+
+        Args:
+            buckets: {key: (burst, refill_per_second)}
+
+        Returns:
+            0 if the tokens were taken, otherwise seconds until all buckets have a token
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            updated = {}
+            retry_after = 0.0
+            for key, (burst, rate) in buckets.items():
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+                updated[key] = tokens
+
+            if not retry_after:
+                conn.executemany(
+                    'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                    [(key, tokens - 1, now) for key, tokens in updated.items()],
+                )
+
+            self._takes += 1
+            if self._takes % 1000 == 0:
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - BUCKET_TTL_SECONDS,))
+            conn.execute('COMMIT')
+            return retry_after
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+class AdmissionGate:
+    def __init__(self, max_inflight: int, max_queued: int):
+        """
+        Shed load before latency collapses. Any request is refused while more than max_queued
+        requests wait for a server thread; expensive ones already at half that depth, or while
+        the process runs max_inflight of them, so cheap routes keep free threads.
+
+        Args:
+            max_inflight: Expensive requests allowed in flight; 0 disables the cap
+            max_queued: Requests allowed to wait in the server's task queue; 0 disables shedding
+        """
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self._slots = threading.BoundedSemaphore(max_inflight) if max_inflight > 0 else None
+        self._queue_depth: Callable[[], int] = lambda: 0
+
+    def watch_queue(self, queue_depth: Callable[[], int]):
+        """
+        Args:
+            queue_depth: Returns how many requests are waiting for a thread; serve.py passes
+                the Waitress task queue. Without it (development server, Vercel) nothing is queued.
+        """
+        self._queue_depth = queue_depth
+
+    def overloaded(self, expensive: bool = False) -> bool:
+        if self.max_queued <= 0:
+            return False
+        limit = self.max_queued // 2 if expensive else self.max_queued
+        return self._queue_depth() > limit
+
+    def try_enter(self) -> bool:
+        if self.overloaded(expensive=True):
+            return False
+        return self._slots is None or self._slots.acquire(blocking=False)
+
+    def leave(self):
+        if self._slots is not None:
+            self._slots.release()
+
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') != '0'
+bucket_store = TokenBucketStore(
+    os.getenv('RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'facemash_rate_limits.db'))
+)
+# Sized from the Waitress thread count (serve.py): expensive requests get at most half of the
+# threads, and a backlog of four requests per thread is shed
+WAITRESS_THREADS = int(os.getenv('WAITRESS_THREADS', 4))
+admission_gate = AdmissionGate(
+    int(os.getenv('MAX_EXPENSIVE_INFLIGHT', max(1, WAITRESS_THREADS // 2))),
+    int(os.getenv('MAX_QUEUED_REQUESTS', WAITRESS_THREADS * 4)),
+)
+
+
+def _reject(status: int, retry_after: float, message: str):
+    return message, status, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+
+def shed_if_overloaded():
+    """before_request hook: answer 503 instead of making a long queue longer"""
+    if RATE_LIMIT_ENABLED and admission_gate.overloaded():
+        return _reject(503, 1, 'The server is busy. Please try again in a moment.')
+    return None
+
+
+def rate_limited(name: str, user_key: Callable[[], Optional[object]]):
+    """
+    Rate limit POSTs to a view per user and per IP, and shed them with 503 when the
+    process already has its quota of expensive requests in flight
+
+    Args:
+        name: Entry in LIMITS
+        user_key: Returns the user the request acts for (ID or submitted username)
+    """
+    limits = LIMITS[name]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED or request.method != 'POST':
+                return view(*args, **kwargs)
+
+            buckets = {f'{name}:ip:{request.remote_addr}': limits['ip']}
+            key = user_key()
+            if key:
+                buckets[f'{name}:user:{key}'] = limits['user']
+            try:
+                retry_after = bucket_store.take(buckets)
+            except Exception as e:
+                # Fail open: a broken limiter store must not take the site down
+                print(f"Rate limiter error: {e}")
+                retry_after = 0
+            if retry_after:
+                return _reject(429, retry_after, 'Too many requests. Please slow down and try again.')
+
+            if not admission_gate.try_enter():
+                return _reject(503, 1, 'The server is busy. Please try again in a moment.')
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission_gate.leave()
+
+        return wrapped
+
+    return decorator
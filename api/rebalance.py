@@ -0,0 +1,162 @@
+# rebalance.py
+# Move users, with their posts, archive, comments and reactions, between database shards
+#
+# CLI: python api/rebalance.py --user USERNAME --shard N   (move one user)
+#      python api/rebalance.py --all                       (move every user to its hash shard,
+#                                                          e.g. after adding shards)
+
+import argparse
+import os
+import time
+
+from sqlalchemy import select
+
+from database import (
+    db,
+    User,
+    UserShard,
+    Post,
+    ArchivedPost,
+    Comment,
+    Reaction,
+    shard_ids,
+    shard_engine,
+    execute_on_shard,
+    hash_shard,
+)
+from archive import ensure_partitions
+
+# Seconds to wait after flagging a user as moving, so writes that checked the directory just
+# before (and like counts still in write buffers) land on the old shard before copying starts
+MOVE_GRACE_SECONDS = int(os.getenv('REBALANCE_GRACE_SECONDS', 5))
+COPY_BATCH_SIZE = 1000
+
+
+def _copy_rows(source, target, table, where, key_column, omit=()):
+    """Copy rows matching `where` from the source to the target connection in key order"""
+    last_key = None
+    copied = 0
+    while True:
+        query = select(table).where(where).order_by(key_column).limit(COPY_BATCH_SIZE)
+        if last_key is not None:
+            query = query.where(key_column > last_key)
+        rows = [dict(row._mapping) for row in source.execute(query)]
+        if not rows:
+            return copied
+        last_key = rows[-1][key_column.name]
+        target.execute(table.insert(), [
+            {name: value for name, value in row.items() if name not in omit} for row in rows
+        ])
+        copied += len(rows)
+
+
+def _delete_user_rows(connection, user_id):
+    """Delete a user's posts and everything attached to them from one shard"""
+    posts = Post.__table__
+    post_ids = select(posts.c.id).where(posts.c.user_id == user_id).scalar_subquery()
+    connection.execute(Reaction.__table__.delete().where(Reaction.__table__.c.post_id.in_(post_ids)))
+    connection.execute(Comment.__table__.delete().where(Comment.__table__.c.post_id.in_(post_ids)))
+    connection.execute(posts.delete().where(posts.c.user_id == user_id))
+    connection.execute(ArchivedPost.__table__.delete().where(ArchivedPost.__table__.c.user_id == user_id))
+
+
+def move_user(user_id, target, grace_seconds=MOVE_GRACE_SECONDS):
+    """
+    Move a user's data to the target shard while the app keeps running
+
+    The user is flagged as moving, which makes writes for them fail with a retry message
+    while reads keep using the old shard. The data is copied, the directory is pointed at
+    the new shard, and only then is the old copy deleted.
+
+    Returns:
+        True if the user was moved, False if they were already on the target shard
+    """
+    directory = db.session.get(UserShard, user_id)
+    if directory is None:
+        # Users registered before sharding have no row and live on shard 0
+        directory = UserShard(user_id=user_id, shard=0)
+        db.session.add(directory)
+    source = directory.shard
+    if source == target:
+        db.session.commit()
+        return False
+
+    directory.moving = True
+    db.session.commit()
+    try:
+        time.sleep(grace_seconds)
+
+        posts = Post.__table__
+        comments = Comment.__table__
+        reactions = Reaction.__table__
+        archived = ArchivedPost.__table__
+        user_posts = select(posts.c.id).where(posts.c.user_id == user_id).scalar_subquery()
+
+        # Archived rows need their monthly partitions on the target (PostgreSQL only)
+        archived_at = execute_on_shard(
+            source, select(archived.c.created_at).where(archived.c.user_id == user_id)
+        ).scalars().all()
+        ensure_partitions(target, archived_at)
+        db.session.commit()
+
+        with shard_engine(source).connect() as src, shard_engine(target).begin() as dst:
+            # Leftovers from an interrupted earlier run would collide with the copy
+            _delete_user_rows(dst, user_id)
+            copied = _copy_rows(src, dst, posts, posts.c.user_id == user_id, posts.c.id)
+            _copy_rows(src, dst, archived, archived.c.user_id == user_id, archived.c.id)
+            _copy_rows(src, dst, comments, comments.c.post_id.in_(user_posts), comments.c.id)
+            # Reaction IDs are only unique per shard, so the target assigns new ones
+            _copy_rows(src, dst, reactions, reactions.c.post_id.in_(user_posts), reactions.c.id, omit=('id',))
+
+        directory.shard = target
+        directory.moving = False
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Leave the user on the source shard, which still has everything
+        directory = db.session.get(UserShard, user_id)
+        directory.moving = False
+        db.session.commit()
+        raise
+
+    with shard_engine(source).begin() as src:
+        _delete_user_rows(src, user_id)
+    print(f"Moved user {user_id} ({copied} posts) from shard {source} to shard {target}")
+    return True
+
+
+def rebalance_all(grace_seconds=MOVE_GRACE_SECONDS):
+    """Move every user whose shard differs from the one their ID hashes to"""
+    shards = dict(db.session.query(UserShard.user_id, UserShard.shard).all())
+    moved = 0
+    for (user_id,) in db.session.query(User.id).order_by(User.id).all():
+        target = hash_shard(user_id)
+        if shards.get(user_id, 0) != target and move_user(user_id, target, grace_seconds):
+            moved += 1
+    print(f"Rebalanced {moved} users across {len(shard_ids())} shards")
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move users between database shards')
+    parser.add_argument('--user', help='Username to move')
+    parser.add_argument('--shard', type=int, help='Target shard for --user')
+    parser.add_argument('--all', action='store_true', help='Move every user to the shard its ID hashes to')
+    parser.add_argument('--grace', type=int, default=MOVE_GRACE_SECONDS,
+                        help='Seconds to let in-flight writes finish before copying a user')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.all:
+            rebalance_all(args.grace)
+        elif args.user is not None and args.shard is not None:
+            if args.shard not in shard_ids():
+                parser.error(f"--shard must be between 0 and {len(shard_ids()) - 1}")
+            user = User.query.filter_by(username=args.user).first()
+            if user is None:
+                parser.error(f"No user named {args.user}")
+            move_user(user.id, args.shard, args.grace)
+        else:
+            parser.error('Pass --all, or --user and --shard')
@@ -0,0 +1,275 @@
+# serve.py
+# Production launcher: preloads the app once, then forks Waitress workers that share one listening socket
+#
+# Run: python api/serve.py
+# Signals to the master: SIGHUP replaces the workers one at a time, SIGTERM/SIGINT stop gracefully
+# The master also runs the live feed stream server (live_feed.py) as one extra process
+
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from waitress import wasyncore
+from waitress.server import create_server
+from waitress.channel import HTTPChannel
+
+from live_feed import LIVE_FEED_ENABLED, StreamServer
+
+WORKERS = int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1))
+
+# Waitress tuning, passed straight through to waitress.create_server
+WAITRESS_SETTINGS = {
+    'threads': int(os.getenv('WAITRESS_THREADS', 4)),
+    'backlog': int(os.getenv('WAITRESS_BACKLOG', 2048)),
+    'connection_limit': int(os.getenv('WAITRESS_CONNECTION_LIMIT', 100)),
+    'channel_timeout': int(os.getenv('WAITRESS_CHANNEL_TIMEOUT', 120)),
+}
+
+# Seconds a stopping worker waits for in-flight requests before exiting anyway
+GRACEFUL_TIMEOUT = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+# Seconds the master waits for a new worker to report ready during a rolling restart
+WORKER_READY_TIMEOUT = 30
+
+
+def _after_fork(app):
+    """Anything holding sockets, locks or threads from the master has to be rebuilt in the child"""
+    from database import reset_after_fork
+    from blob_storage import reset_blob_storage
+    from rate_limit import bucket_store
+    from live_feed import event_log
+
+    reset_after_fork(app)
+    reset_blob_storage()
+    bucket_store.reset_after_fork()
+    event_log.reset_after_fork()
+
+
+def _busy_channels(server):
+    return [
+        channel for channel in list(server._map.values())
+        if isinstance(channel, HTTPChannel) and (channel.requests or channel.total_outbufs_len)
+    ]
+
+
+def _drain_and_exit(server):
+    """Wait for in-flight requests to finish, then close every channel so server.run() returns"""
+    deadline = time.time() + GRACEFUL_TIMEOUT
+    while _busy_channels(server) and time.time() < deadline:
+        time.sleep(0.1)
+    # Thunks run on the main loop thread, which owns the channel map; closing the trigger
+    # along with everything else empties the map and server.run() returns
+    try:
+        server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+    except OSError:
+        # The loop already closed the trigger, so it is on its way out
+        pass
+
+
+def _watch_queue(server):
+    """Let the admission gate shed load based on this server's task queue"""
+    from rate_limit import admission_gate
+
+    admission_gate.watch_queue(lambda: len(server.task_dispatcher.queue))
+
+
+def _drain_on(server, *signums):
+    """Make the given signals stop accepting and let server.run() return once in-flight requests finish"""
+    draining = threading.Event()
+
+    def stop(signum, frame):
+        if draining.is_set():
+            return
+        draining.set()
+        # Stop accepting; in prefork mode the master and the other workers keep the socket open
+        server.trigger.pull_trigger(server.del_channel)
+        threading.Thread(target=_drain_and_exit, args=(server,), daemon=True).start()
+
+    for signum in signums:
+        signal.signal(signum, stop)
+
+
+def _finish(server):
+    """
+    After server.run() returns: wait for the request threads, then flush buffered writes.
+    Workers leave through os._exit and a signal-stopped process may skip atexit, so this
+    can't be left to the atexit hooks.
+    """
+    server.task_dispatcher.shutdown(timeout=GRACEFUL_TIMEOUT)
+
+    from database import reaction_counts, timeline_fanout
+
+    timeline_fanout.stop()
+    reaction_counts.stop()
+
+
+def _run_worker(app, sock, ready_fd):
+    _after_fork(app)
+    server = create_server(app, sockets=[sock], **WAITRESS_SETTINGS)
+    _watch_queue(server)
+
+    _drain_on(server, signal.SIGTERM)
+    # The master relays Ctrl-C as SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+    server.run()
+    _finish(server)
+
+
+def _run_live_feed(app):
+    """One stream server per host; it reads events from every worker through the shared log"""
+    from database import db
+    from live_feed import StreamServer, event_log
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    event_log.reset_after_fork()
+    StreamServer(app).run()
+
+
+class Master:
+    def __init__(self, app, host, port, workers):
+        self.app = app
+        self.workers = workers
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(WAITRESS_SETTINGS['backlog'])
+        self.pids = set()
+        self.live_feed_pid = None
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self):
+        """Fork a worker and wait until it is accepting connections"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 0
+            try:
+                _run_worker(self.app, self.sock, write_fd)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} crashed: {e}")
+                status = 1
+            finally:
+                # Never fall back into the master's code in the child
+                os._exit(status)
+
+        os.close(write_fd)
+        self.pids.add(pid)
+        deadline = time.time() + WORKER_READY_TIMEOUT
+        with os.fdopen(read_fd, 'rb') as ready:
+            os.set_blocking(read_fd, False)
+            while time.time() < deadline and not ready.read(1):
+                time.sleep(0.05)
+        return pid
+
+    def spawn_live_feed(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self.sock.close()
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                _run_live_feed(self.app)
+            except BaseException as e:
+                print(f"Live feed server {os.getpid()} crashed: {e}")
+                status = 1
+            finally:
+                os._exit(status)
+        self.live_feed_pid = pid
+
+    def stop_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        self.pids.discard(pid)
+
+    def rolling_restart(self):
+        """Replace workers one by one so there is always a full set accepting connections"""
+        for pid in list(self.pids):
+            self.spawn()
+            self.stop_worker(pid)
+        print(f"Rolling restart complete, {len(self.pids)} workers")
+
+    def run(self):
+        # Forking a multi-threaded process can deadlock the child, so the master parks its
+        # background threads; every worker starts its own in _after_fork
+        from database import reaction_counts, timeline_fanout
+
+        timeline_fanout.stop()
+        reaction_counts.stop()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        for _ in range(self.workers):
+            self.spawn()
+        if LIVE_FEED_ENABLED:
+            self.spawn_live_feed()
+        print(f"Serving on http://{self.sock.getsockname()[0]}:{self.sock.getsockname()[1]} "
+              f"with {self.workers} workers x {WAITRESS_SETTINGS['threads']} threads")
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_restart()
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in self.pids:
+                self.pids.discard(pid)
+                print(f"Worker {pid} exited with status {status}, starting a replacement")
+                self.spawn()
+            elif pid and pid == self.live_feed_pid:
+                print(f"Live feed server exited with status {status}, restarting it")
+                self.spawn_live_feed()
+            time.sleep(0.5)
+
+        for pid in list(self.pids):
+            os.kill(pid, signal.SIGTERM)
+        if self.live_feed_pid:
+            self.stop_worker(self.live_feed_pid)
+        for pid in list(self.pids):
+            self.stop_worker(pid)
+        self.sock.close()
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+
+def serve_forever(app, host='0.0.0.0', port=5000, workers=WORKERS):
+    """Serve with `workers` forked processes, or in this process when workers is 1 or fork is unavailable"""
+    if workers <= 1 or not hasattr(os, 'fork'):
+        if LIVE_FEED_ENABLED:
+            StreamServer(app).start_thread()
+        logging.basicConfig()
+        server = create_server(app, host=host, port=port, **WAITRESS_SETTINGS)
+        _watch_queue(server)
+        _drain_on(server, signal.SIGTERM, signal.SIGINT)
+        server.print_listen('Serving on http://{}:{}')
+        server.run()
+        _finish(server)
+        return
+    Master(app, host, port, workers).run()
+
+
+if __name__ == '__main__':
+    # Imported once here so every worker starts with the app already loaded
+    from app import app
+
+    serve_forever(app, port=int(os.getenv('PORT', 5000)))
@@ -0,0 +1,235 @@
+# static_assets.py
+# Build step and runtime helpers for purged, fingerprinted and precompressed CSS
+#
+# Build: pip install -r requirements-build.txt && python api/static_assets.py [--source path/to/tailwind.min.css]
+# Runs as the Vercel build command (vercel.json), before the app's dependencies are installed,
+# so the build only needs the standard library and brotli
+
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import urllib.request
+from typing import Iterable, List, Optional, Set
+
+try:
+    import brotli
+except ImportError:  # Required by build() unless gzip_only; the app itself never needs it
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+DIST_DIR = os.path.join(BASE_DIR, 'static', 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+APP_STYLES = os.path.join(BASE_DIR, 'static', 'styles.css')
+
+TAILWIND_URL = 'https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css'
+# Fingerprinted files never change, so browsers and CDNs may cache them forever
+IMMUTABLE_MAX_AGE = 31536000
+
+# At-rules whose bodies hold style rules that should be purged; others are kept verbatim
+NESTED_AT_RULES = ('@media', '@supports')
+
+_TOKEN_RE = re.compile(r'[A-Za-z0-9_:/.\-]+')
+_CLASS_RE = re.compile(r'\.((?:\\[0-9a-fA-F]{1,6} ?|\\.|[A-Za-z0-9_-])+)')
+_ESCAPE_RE = re.compile(r'\\([0-9a-fA-F]{1,6}) ?|\\(.)')
+
+
+def collect_used_tokens(paths: Iterable[str]) -> Set[str]:
+    """Every word-like token in the templates, which over-approximates the classes they use"""
+    tokens = set()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            tokens.update(_TOKEN_RE.findall(f.read()))
+    return tokens
+
+
+def _unescape(name: str) -> str:
+    return _ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)) if m.group(1) else m.group(2), name)
+
+
+def _split_blocks(css: str) -> List[tuple]:
+    """
+    Split CSS into top-level (prelude, body) pairs; statements such as @charset
+    come back with a body of None
+    """
+    blocks = []
+    i, start, depth, n = 0, 0, 0, len(css)
+    prelude = None
+    while i < n:
+        ch = css[i]
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            if depth == 0:
+                start = i
+            continue
+        if ch in '"\'':
+            end = i + 1
+            while end < n and css[end] != ch:
+                end += 2 if css[end] == '\\' else 1
+            i = end + 1
+            continue
+        if ch == '{':
+            if depth == 0:
+                prelude = css[start:i].strip()
+                start = i + 1
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[start:i]))
+                start = i + 1
+        elif ch == ';' and depth == 0:
+            blocks.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return blocks
+
+
+def _selector_used(selector: str, used: Set[str]) -> bool:
+    return all(_unescape(name) in used for name in _CLASS_RE.findall(selector))
+
+
+def purge_css(css: str, used: Set[str]) -> str:
+    """Drop every selector that references a class not in `used`"""
+    out = []
+    for prelude, body in _split_blocks(css):
+        if body is None:
+            out.append(prelude + ';')
+        elif prelude.startswith(NESTED_AT_RULES):
+            inner = purge_css(body, used)
+            if inner:
+                out.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            out.append(f'{prelude}{{{body}}}')
+        else:
+            selectors = [s for s in prelude.split(',') if _selector_used(s, used)]
+            if selectors:
+                out.append(f'{",".join(s.strip() for s in selectors)}{{{body}}}')
+    return ''.join(out)
+
+
+def _load_tailwind(source: Optional[str]) -> str:
+    if source:
+        with open(source, encoding='utf-8') as f:
+            return f.read()
+
+    cache = os.path.join(tempfile.gettempdir(), 'tailwind-2.2.19.min.css')
+    if not os.path.exists(cache):
+        print(f"Downloading {TAILWIND_URL}")
+        urllib.request.urlretrieve(TAILWIND_URL, cache)
+    with open(cache, encoding='utf-8') as f:
+        return f.read()
+
+
+def _write_variants(name: str, data: bytes, gzip_only: bool = False) -> str:
+    """Write name with a content hash plus .gz/.br siblings; returns the hashed filename"""
+    stem, ext = os.path.splitext(name)
+    hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+    path = os.path.join(DIST_DIR, hashed)
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if not gzip_only:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+    return hashed
+
+
+def build(source: Optional[str] = None, gzip_only: bool = False) -> dict:
+    """
+    Purge Tailwind and styles.css against the templates and write the dist files and manifest.
+    Fails without brotli unless gzip_only is set, so a deploy can't silently lose the .br variants.
+    """
+    if brotli is None and not gzip_only:
+        raise SystemExit(
+            "brotli is not installed: pip install -r requirements-build.txt, "
+            "or pass --gzip-only to build without .br variants"
+        )
+    css = _load_tailwind(source)
+    if os.path.exists(APP_STYLES):
+        with open(APP_STYLES, encoding='utf-8') as f:
+            css += '\n' + f.read()
+
+    templates = glob.glob(os.path.join(TEMPLATES_DIR, '*.html'))
+    full = purge_css(css, collect_used_tokens(templates))
+    # base.html renders on every page, so its rules are inlined to paint the layout without a round trip
+    critical = purge_css(css, collect_used_tokens([os.path.join(TEMPLATES_DIR, 'base.html')]))
+
+    os.makedirs(DIST_DIR, exist_ok=True)
+    for old in glob.glob(os.path.join(DIST_DIR, 'app.*')):
+        os.remove(old)
+    manifest = {
+        'app.css': _write_variants('app.css', full.encode('utf-8'), gzip_only),
+        'critical_css': critical,
+    }
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    print(f"Purged CSS from {len(css)} to {len(full)} bytes ({len(critical)} bytes critical)")
+    return manifest
+
+
+def init_assets(app):
+    """Register the asset template helpers and the precompressed /assets route"""
+    from flask import request, send_from_directory, abort
+
+    manifest = {}
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            manifest = json.load(f)
+    else:
+        print("Static assets not built, using the Tailwind CDN (run python api/static_assets.py)")
+
+    @app.template_global()
+    def asset_url(name):
+        """URL of the fingerprinted build of `name`, or None when assets have not been built"""
+        hashed = manifest.get(name)
+        return f"/assets/{hashed}" if hashed else None
+
+    @app.template_global()
+    def critical_css():
+        return manifest.get('critical_css', '')
+
+    @app.route('/assets/<filename>')
+    def asset(filename):
+        if filename not in manifest.values():
+            abort(404)
+
+        # Highest q-value wins, br on a tie; q=0 refuses an encoding
+        variants = [
+            (request.accept_encodings.quality(candidate), candidate, suffix)
+            for candidate, suffix in (('br', '.br'), ('gzip', '.gz'))
+            if os.path.exists(os.path.join(DIST_DIR, filename + suffix))
+        ]
+        quality, encoding, suffix = max(variants, key=lambda variant: variant[0], default=(0, None, ''))
+        if quality > 0:
+            filename += suffix
+        else:
+            encoding = None
+
+        response = send_from_directory(
+            DIST_DIR, filename, mimetype='text/css', max_age=IMMUTABLE_MAX_AGE, conditional=True
+        )
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            # Don't advertise the .gz/.br name; the resource is still the CSS file
+            response.headers.pop('Content-Disposition', None)
+        return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build purged, fingerprinted and precompressed CSS')
+    parser.add_argument('--source', help='Local copy of tailwind.min.css instead of downloading it')
+    parser.add_argument('--gzip-only', action='store_true', help='Build without brotli (.gz variants only)')
+    args = parser.parse_args()
+    build(args.source, args.gzip_only)
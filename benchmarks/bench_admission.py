@@ -0,0 +1,110 @@
+# bench_admission.py
+# Flood /login (PBKDF2) while timing /feed, with rate limiting and admission control off and on
+#
+# Usage: python benchmarks/bench_admission.py [seconds] [flood_clients]
+
+import http.cookiejar
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "app.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def post(opener, url, data):
+    try:
+        return opener.open(url, urllib.parse.urlencode(data).encode()).status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run(limits_enabled, seconds, flood_clients):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(
+            os.environ,
+            FLASK_ENV="production",
+            PORT=str(port),
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            RATE_LIMIT_DB=os.path.join(tmp, "rate_limits.db"),
+            RATE_LIMIT_ENABLED="1" if limits_enabled else "0",
+        )
+        server = subprocess.Popen(
+            [sys.executable, APP], env=env, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        base = f"http://127.0.0.1:{port}"
+        try:
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(base + "/")
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            reader = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            post(reader, base + "/register", {"username": "reader", "password": "pw"})
+            post(reader, base + "/login", {"username": "reader", "password": "pw"})
+
+            stop = threading.Event()
+            flood_codes = Counter()
+
+            def flood():
+                opener = urllib.request.build_opener()
+                while not stop.is_set():
+                    flood_codes[post(opener, base + "/login", {"username": "reader", "password": "wrong"})] += 1
+
+            flooders = [threading.Thread(target=flood) for _ in range(flood_clients)]
+            for thread in flooders:
+                thread.start()
+
+            latencies = []
+            shed_reads = 0
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                started = time.perf_counter()
+                try:
+                    reader.open(base + "/feed").read()
+                except urllib.error.HTTPError as e:
+                    if e.code != 503:
+                        raise
+                    shed_reads += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            stop.set()
+            for thread in flooders:
+                thread.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+    mode = "limits on" if limits_enabled else "limits off"
+    print(
+        f"{mode:>10}: feed p50={percentile(latencies, 50):.1f}ms p99={percentile(latencies, 99):.1f}ms "
+        f"({len(latencies)} reads, {shed_reads} shed), flood responses {dict(flood_codes)}"
+    )
+
+
+if __name__ == "__main__":
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    flood_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    run(False, seconds, flood_clients)
+    run(True, seconds, flood_clients)
@@ -0,0 +1,73 @@
+# bench_live_feed.py
+# Open thousands of idle /feed/stream connections and time how long each broadcast takes to reach all of them
+#
+# Usage: python benchmarks/bench_live_feed.py [connections] [events]
+
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+TMP = tempfile.mkdtemp()
+os.environ["LIVE_FEED_DB"] = os.path.join(TMP, "live_feed.db")
+os.environ["LIVE_FEED_ENABLED"] = "1"
+
+from flask import Flask
+from live_feed import StreamServer, publish
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def main(connections, events):
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "bench"
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": "1"})
+
+    port = free_port()
+    StreamServer(app, host="127.0.0.1", port=port).start_thread()
+    await asyncio.sleep(0.5)
+
+    request = (
+        f"GET /feed/stream?view=all HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nCookie: session={cookie}\r\n\r\n"
+    ).encode()
+    streams = []
+    for _ in range(connections):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        await reader.readuntil(b"retry: 3000\n\n")
+        streams.append((reader, writer))
+    print(f"{connections} streams open, {threading.active_count()} threads in the process")
+
+    latencies = []
+    for i in range(events):
+        started = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, publish, "post", {"id": i, "user_id": 2})
+        await asyncio.gather(*(reader.readuntil(b"\n\n") for reader, _ in streams))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    for _, writer in streams:
+        writer.close()
+    print(
+        f"broadcast to all {connections}: p50={percentile(latencies, 50):.1f}ms "
+        f"p99={percentile(latencies, 99):.1f}ms over {events} events"
+    )
+
+
+if __name__ == "__main__":
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(connections, events))
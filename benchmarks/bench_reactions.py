@@ -0,0 +1,74 @@
+# bench_reactions.py
+# Benchmark thousands of concurrent likes on a single post, buffered vs write-through counters
+#
+# Usage: python benchmarks/bench_reactions.py [likes] [threads]
+
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from flask import Flask
+from database import db, User, Post, toggle_reaction, reaction_counts, _flush_like_counts
+
+
+def make_app(db_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": {"timeout": 30}}
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def run(mode, likes, threads):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+
+        def flush_in_context(deltas):
+            with app.app_context():
+                _flush_like_counts(deltas)
+
+        reaction_counts.flush_fn = flush_in_context
+        reaction_counts.flush_interval = 0.25 if mode == "buffered" else 0
+
+        with app.app_context():
+            db.session.add_all(User(username=f"user{i}", password="x") for i in range(likes))
+            author = User(username="author", password="x")
+            db.session.add(author)
+            db.session.flush()
+            post = Post(user_id=author.id, content="hot post")
+            db.session.add(post)
+            db.session.commit()
+            post_id, author_id = post.id, author.id
+            user_ids = [u.id for u in User.query.filter(User.id != author.id)]
+
+        def like(user_id):
+            with app.app_context():
+                toggle_reaction(post_id, author_id, user_id)
+
+        reaction_counts.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(like, user_ids))
+        elapsed = time.perf_counter() - started
+        reaction_counts.stop()
+
+        with app.app_context():
+            stored = db.session.get(Post, post_id).like_count
+            db.session.remove()
+            db.engine.dispose()
+
+    print(f"{mode:>13}: {likes} likes in {elapsed:.2f}s ({likes / elapsed:.0f} likes/s), stored like_count={stored}")
+    assert stored == likes, "likes were lost"
+
+
+if __name__ == "__main__":
+    likes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    run("write-through", likes, threads)
+    run("buffered", likes, threads)
@@ -0,0 +1,88 @@
+# bench_server.py
+# Requests per second for the login page and the feed with one Waitress process vs N forked workers
+#
+# Usage: python benchmarks/bench_server.py [seconds] [clients] [workers]
+
+import http.cookiejar
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+SERVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "serve.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run(workers, seconds, clients):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(
+            os.environ,
+            FLASK_ENV="production",
+            PORT=str(port),
+            WEB_CONCURRENCY=str(workers),
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            RATE_LIMIT_DB=os.path.join(tmp, "rate_limits.db"),
+            RATE_LIMIT_ENABLED="0",
+        )
+        server = subprocess.Popen(
+            [sys.executable, SERVE], env=env, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        base = f"http://127.0.0.1:{port}"
+        try:
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(base + "/")
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            # Every client shares the logged-in session so /feed renders real posts
+            jar = http.cookiejar.CookieJar()
+            writer = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+            for path, data in (("/register", {"username": "bench", "password": "pw"}),
+                               ("/login", {"username": "bench", "password": "pw"})):
+                writer.open(base + path, urllib.parse.urlencode(data).encode()).read()
+            for i in range(50):
+                writer.open(base + "/create_post", urllib.parse.urlencode({"content": f"post {i}"}).encode()).read()
+
+            results = {}
+            for path in ("/login", "/feed"):
+                counts = [0] * clients
+                deadline = time.time() + seconds
+
+                def client(slot):
+                    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+                    while time.time() < deadline:
+                        opener.open(base + path).read()
+                        counts[slot] += 1
+
+                threads = [threading.Thread(target=client, args=(slot,)) for slot in range(clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                results[path] = sum(counts) / seconds
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{workers:>3} worker(s): " + ", ".join(f"{path} {rps:.0f} req/s" for path, rps in results.items()))
+
+
+if __name__ == "__main__":
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 2)
+    run(1, seconds, clients)
+    run(workers, seconds, clients)
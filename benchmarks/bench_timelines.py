@@ -0,0 +1,109 @@
+# bench_timelines.py
+# Benchmark home timeline fan-out for uniform and skewed (Zipf) follower distributions,
+# comparing pure fan-out-on-write with the hybrid push/pull mode
+#
+# Usage: python benchmarks/bench_timelines.py [users] [follows_per_user] [posts]
+
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from flask import Flask
+import database
+from database import db, User, Post, Follow, TimelineEntry, get_home_timeline, _fan_out_post
+
+
+def make_app(db_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def build_graph(distribution, users, follows_per_user, rng):
+    """Return (follower_id, followed_id) pairs; user ids are 1..users"""
+    ids = list(range(1, users + 1))
+    if distribution == "skewed":
+        weights = [1 / rank ** 1.1 for rank in ids]
+    else:
+        weights = None
+    edges = set()
+    for follower in ids:
+        for followed in rng.choices(ids, weights=weights, k=follows_per_user):
+            if followed != follower:
+                edges.add((follower, followed))
+    return edges
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run(distribution, mode, users, follows_per_user, posts):
+    rng = random.Random(42)
+    database.FANOUT_FOLLOWER_THRESHOLD = 10 ** 9 if mode == "push" else max(100, follows_per_user * 10)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            edges = build_graph(distribution, users, follows_per_user, rng)
+            followers = Counter(followed for _, followed in edges)
+            db.session.execute(
+                User.__table__.insert(),
+                [
+                    {"id": i, "username": f"user{i}", "password": "x", "follower_count": followers[i]}
+                    for i in range(1, users + 1)
+                ],
+            )
+            db.session.execute(
+                Follow.__table__.insert(),
+                [{"follower_id": a, "followed_id": b} for a, b in edges],
+            )
+            db.session.commit()
+
+            post_ids = []
+            for i in range(posts):
+                post = Post(user_id=rng.randint(1, users), content=f"post {i}")
+                db.session.add(post)
+                db.session.flush()
+                post_ids.append((post.id, post.user_id))
+            db.session.commit()
+
+            started = time.perf_counter()
+            for post_id, author_id in post_ids:
+                _fan_out_post(post_id, author_id)
+            write_elapsed = time.perf_counter() - started
+            rows = db.session.query(TimelineEntry).count()
+
+            readers = rng.sample(range(1, users + 1), min(users, 500))
+            latencies = []
+            for reader in readers:
+                started = time.perf_counter()
+                get_home_timeline(reader)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            db.session.remove()
+            db.engine.dispose()
+
+    print(
+        f"{distribution:>8} {mode:>6}: fan-out {posts} posts in {write_elapsed:.2f}s, "
+        f"{rows} timeline rows ({rows / posts:.0f}/post), "
+        f"read p50={percentile(latencies, 50):.2f}ms p99={percentile(latencies, 99):.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    follows_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    posts = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    for distribution in ("uniform", "skewed"):
+        for mode in ("push", "hybrid"):
+            run(distribution, mode, users, follows_per_user, posts)
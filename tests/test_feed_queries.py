@@ -0,0 +1,83 @@
+# test_feed_queries.py
+# The feed runs the same number of queries however many posts, authors and comments a page shows
+#
+# Usage: python -m pytest tests
+
+import os
+import sys
+import tempfile
+
+TMP = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TMP, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+os.environ["RATE_LIMIT_DB"] = os.path.join(TMP, "rate_limits.db")
+os.environ["LIVE_FEED_DB"] = os.path.join(TMP, "live_feed.db")
+os.environ["FANOUT_ASYNC"] = "0"
+os.environ["REACTION_FLUSH_INTERVAL_MS"] = "0"
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from sqlalchemy import event, func, select
+
+from app import app
+from database import (
+    db,
+    Post,
+    User,
+    create_user,
+    get_user_by_username,
+    create_new_post,
+    add_comment,
+    toggle_reaction,
+    follow_user,
+)
+
+
+def add_posts(count):
+    """`count` posts by new authors, each followed, liked and commented on by the viewer"""
+    with app.app_context():
+        viewer_id = get_user_by_username("viewer").id
+        start = db.session.execute(select(func.count()).select_from(User)).scalar()
+        for i in range(start, start + count):
+            create_user(f"author{i}", "pw")
+            author_id = get_user_by_username(f"author{i}").id
+            follow_user(viewer_id, author_id)
+            create_new_post(author_id, f"post {i}")
+            post_id = db.session.execute(select(func.max(Post.id))).scalar()
+            add_comment(post_id, author_id, author_id, f"comment on {i}")
+            add_comment(post_id, author_id, viewer_id, f"reply to {i}")
+            toggle_reaction(post_id, author_id, viewer_id)
+
+
+def count_queries(client, path):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return response, len(statements)
+
+
+def test_feed_query_count_is_constant():
+    with app.app_context():
+        create_user("viewer", "pw")
+    client = app.test_client()
+    client.post("/login", data={"username": "viewer", "password": "pw"})
+
+    counts = {}
+    for total, batch in ((3, 3), (13, 10)):
+        add_posts(batch)
+        for path in ("/feed", "/feed?view=all"):
+            response, counts[path, total] = count_queries(client, path)
+            assert response.data.count(b"Unlike (1)") == total
+
+    for path in ("/feed", "/feed?view=all"):
+        assert counts[path, 13] == counts[path, 3], path